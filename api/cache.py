@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from loguru import logger
+
+from database.tools import CRUD
+from utils.misc.metrics import CACHE_EVICTIONS, CACHE_REQUESTS, CACHE_SIZE
+
+
+def normalize_key(value: str) -> str:
+    '''Приведение строки к ключу кэша: регистр и пробелы не учитываются'''
+    return ' '.join(value.split()).casefold()
+
+
+class TTLCache:
+    '''
+    Потокобезопасный кэш в памяти с временем жизни записей
+    и вытеснением давно не использованных (LRU).
+    Может дублировать записи в постоянное хранилище (storage),
+    у которого есть методы load(key) и save(key, value, stored_at).
+    Устаревшие записи хранятся в памяти еще stale_ttl секунд
+    и доступны через get_stale, например пока источник недоступен.
+    Кэш с именем name отдает попадания, промахи, вытеснения и размер
+    в метрики.
+    '''
+
+    def __init__(self,
+                 maxsize: int,
+                 ttl: float,
+                 storage: Optional[Any] = None,
+                 stale_ttl: float = 0,
+                 name: Optional[str] = None) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.storage = storage
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if name is not None:
+            CACHE_SIZE.set_function(self.__len__, cache=name)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _count(self, result: str) -> None:
+        if result == 'hit':
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.name is not None:
+            CACHE_REQUESTS.inc(cache=self.name, result=result)
+
+    def _is_fresh(self, stored_at: float) -> bool:
+        return time.time() - stored_at < self.ttl
+
+    def _is_stale_usable(self, stored_at: float) -> bool:
+        return time.time() - stored_at < self.ttl + self.stale_ttl
+
+    def _put(self, key: Hashable, value: Any, stored_at: float) -> None:
+        self._data[key] = (value, stored_at)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+            if self.name is not None:
+                CACHE_EVICTIONS.inc(cache=self.name)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        '''Получение значения из кэша, при отсутствии - default'''
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, stored_at = item
+                if self._is_fresh(stored_at):
+                    self._data.move_to_end(key)
+                    self._count('hit')
+                    return value
+                if not self._is_stale_usable(stored_at):
+                    del self._data[key]
+        if self.storage is not None:
+            try:
+                item = self.storage.load(key)
+            except Exception as error:
+                logger.exception(
+                    f'Ошибка чтения кэша из хранилища по ключу {key}: {error}')
+                item = None
+            if item is not None and self._is_fresh(item[1]):
+                with self._lock:
+                    self._put(key, item[0], item[1])
+                    self._count('hit')
+                return item[0]
+        with self._lock:
+            self._count('miss')
+        return default
+
+    def get_stale(self, key: Hashable, default: Any = None) -> Any:
+        '''
+        Получение значения из памяти, даже устаревшего,
+        если с окончания TTL прошло меньше stale_ttl секунд
+        '''
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self._is_stale_usable(item[1]):
+                return item[0]
+        return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        '''Запись значения в кэш'''
+        stored_at = time.time()
+        with self._lock:
+            self._put(key, value, stored_at)
+        if self.storage is not None:
+            try:
+                self.storage.save(key, value, stored_at)
+            except Exception as error:
+                logger.exception(
+                    f'Ошибка записи кэша в хранилище по ключу {key}: {error}')
+
+    def clear(self) -> None:
+        '''Очистка кэша в памяти'''
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        '''Счетчики попаданий, промахов и вытеснений'''
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class _FlightCall:
+    '''Выполняющийся вызов и его результат'''
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    '''
+    Объединение одновременных вызовов с одинаковым ключом:
+    функция выполняется один раз, остальные вызовы ждут ее результат.
+    '''
+
+    def __init__(self) -> None:
+        self._calls: Dict[Hashable, _FlightCall] = {}
+        self._lock = threading.Lock()
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable, *args, **kwargs) -> Any:
+        '''Выполнение func или ожидание уже выполняющегося вызова'''
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _FlightCall()
+            else:
+                self.shared += 1
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class SqliteCacheStorage:
+    '''Постоянное хранилище записей кэша в базе бота'''
+
+    def __init__(self, namespace: str) -> None:
+        self.namespace = namespace
+
+    def load(self, key: str) -> Optional[tuple]:
+        return CRUD.get_cache_entry(self.namespace, key)
+
+    def save(self, key: str, value: Any, stored_at: float) -> None:
+        CRUD.set_cache_entry(self.namespace, key, value, stored_at)
@@ -0,0 +1,124 @@
+import bisect
+import heapq
+from array import array
+from typing import List, Optional
+
+from utils.misc.records import HotelResult
+
+
+class HotelIndex:
+    '''
+    Индекс отелей одного ответа списка отелей для региона и дат.
+    Отели хранятся по столбцам (id, название, цена, расстояние),
+    порядок по цене и по расстоянию вычисляется один раз.
+    Хранит условия запроса, по которым определяется, можно ли ответить
+    на другой запрос того же региона и дат без обращения к API.
+    '''
+    __slots__ = ('ids', 'names', 'prices', 'distances',
+                 'by_price_desc', 'by_price', 'by_distance',
+                 'sorted_distances',
+                 'sort', 'price_min', 'price_max', 'is_complete')
+
+    def __init__(self,
+                 hotels: List[HotelResult],
+                 sort: Optional[str] = None,
+                 price_min: Optional[float] = None,
+                 price_max: Optional[float] = None,
+                 is_complete: bool = False) -> None:
+        '''
+        hotels - отели ответа API (id, название, цена, расстояние)
+        в порядке ответа, sort и price_min/price_max - сортировка и
+        фильтр цены запроса, is_complete - ответ содержит все отели,
+        подходящие под фильтр
+        '''
+        self.ids = [hotel.id for hotel in hotels]
+        self.names = [hotel.name for hotel in hotels]
+        self.prices = array('d', (hotel.price for hotel in hotels))
+        self.distances = array('d', (hotel.distance for hotel in hotels))
+        self.by_price_desc = array('I', sorted(
+            range(len(hotels)), key=self.prices.__getitem__, reverse=True))
+        self.by_distance = array('I', sorted(
+            range(len(hotels)), key=self.distances.__getitem__))
+        # По цене, при равной цене - по расстоянию
+        self.by_price = array('I', sorted(
+            self.by_distance, key=self.prices.__getitem__))
+        self.sorted_distances = array(
+            'd', (self.distances[index] for index in self.by_distance))
+        self.sort = sort
+        self.price_min = price_min
+        self.price_max = price_max
+        self.is_complete = is_complete
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _get_hotel(self, index: int) -> HotelResult:
+        return HotelResult(self.ids[index], self.names[index],
+                           self.prices[index], self.distances[index])
+
+    def _is_price_unfiltered(self) -> bool:
+        return self.price_min is None and self.price_max is None
+
+    def _covers_price_range(self, low_price: float,
+                            high_price: float) -> bool:
+        return ((self.price_min is None or self.price_min <= low_price)
+                and (self.price_max is None or high_price <= self.price_max))
+
+    def can_answer_highest_price(self) -> bool:
+        '''
+        Ответ /high: самые дорогие среди отелей ответа без сортировки
+        и фильтров, как при запросе к API
+        '''
+        return self._is_price_unfiltered() and (
+            self.sort is None or self.is_complete)
+
+    def highest_price(self, limit: int) -> List[HotelResult]:
+        '''Отели по убыванию цены'''
+        return [self._get_hotel(index)
+                for index in self.by_price_desc[:limit]]
+
+    def can_answer_best_deals(self, distance: float, low_price: float,
+                              high_price: float) -> bool:
+        '''
+        Ответ /bestdeals: в индексе есть все отели в диапазоне цен
+        ближе distance. Для неполного ответа, отсортированного по
+        расстоянию, это верно до расстояния последнего отеля ответа.
+        '''
+        if not self._covers_price_range(low_price, high_price):
+            return False
+        if self.is_complete:
+            return True
+        return (self.sort == 'DISTANCE' and len(self) > 0
+                and distance <= self.sorted_distances[-1])
+
+    def best_deals(self, distance: float, low_price: float,
+                   high_price: float, limit: int) -> List[HotelResult]:
+        '''
+        Самые дешевые отели ближе distance в диапазоне цен,
+        при равной цене - ближайшие. Если фильтр цены ответа совпадает
+        с запрошенным, отели по цене не отбираются: как и без индекса,
+        достаточно фильтра цены API.
+        '''
+        if (self.price_min, self.price_max) == (low_price, high_price):
+            low_price, high_price = float('-inf'), float('inf')
+        end = bisect.bisect_left(self.sorted_distances, distance)
+        if end <= limit * 4:
+            # Отелей ближе distance мало: выбор среди них
+            candidates = [
+                index for index in self.by_distance[:end]
+                if low_price <= self.prices[index] <= high_price]
+            selected = heapq.nsmallest(
+                limit, candidates,
+                key=lambda index: (self.prices[index],
+                                   self.distances[index]))
+        else:
+            # Иначе первые подходящие отели по возрастанию цены
+            selected = []
+            for index in self.by_price:
+                price = self.prices[index]
+                if price > high_price or len(selected) == limit:
+                    break
+                if (price >= low_price
+                        and self.distances[index] < distance):
+                    selected.append(index)
+        return [self._get_hotel(index) for index in selected]
@@ -1,10 +1,18 @@
+import contextvars
 import datetime
-from typing import Dict, List, Tuple
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
 
-import requests
 from loguru import logger
 
+from api import cache, http_client, parsers
+from api.hotel_index import HotelIndex
 from config_data import config
+from database.tools import CRUD
+from database.tools.history_writer import history_writer
+from utils.misc.records import HotelResult
 
 
 class API_SETTINGS:
@@ -19,16 +27,44 @@ class API_SETTINGS:
         "X-RapidAPI-Host": config.RAPID_API_HOST
     }
 
-    TIMEOUT = config.REQUESTS_TIMEOUT
+
+cities_cache = cache.TTLCache(
+    maxsize=config.CITIES_CACHE_SIZE,
+    ttl=config.CITIES_CACHE_TTL,
+    storage=(cache.SqliteCacheStorage('cities')
+             if config.CITIES_CACHE_PERSISTENT else None),
+    name='cities'
+)
+search_cache = cache.TTLCache(
+    maxsize=config.SEARCH_CACHE_SIZE,
+    ttl=config.SEARCH_CACHE_TTL,
+    stale_ttl=config.SEARCH_CACHE_STALE_TTL,
+    name='search'
+)
+search_flight = cache.SingleFlight()
+# Индексы последних списков отелей по региону и датам для /high и /bestdeals
+hotel_indexes = cache.TTLCache(
+    maxsize=config.HOTEL_INDEX_SIZE,
+    ttl=config.SEARCH_CACHE_TTL,
+    name='hotel_index'
+)
 
 
 @logger.catch
 def request_cities(location_name: str) -> Tuple[bool, List[Tuple[str, str]]]:
     '''
-    Получение городо по заданному имени локации
+    Получение городо по заданному имени локации.
+    Результаты кэшируются по нормализованному имени локации.
+    Пустой ответ не кэшируется: опечатка или временно пустой ответ API
+    не должны скрывать город на время CITIES_CACHE_TTL.
     :param location_name:
     :return:
     '''
+    cache_key = cache.normalize_key(location_name)
+    cached_results = cities_cache.get(cache_key)
+    if cached_results:
+        logger.debug(f'Локации для {location_name} получены из кэша')
+        return True, [tuple(item) for item in cached_results]
     params = {
         'q': location_name,
         'locale': 'ru_RU'
@@ -52,30 +88,10 @@ def request_cities(location_name: str) -> Tuple[bool, List[Tuple[str, str]]]:
         logger.exception(
             ('Ошибка при разборе ответа от сервера '
              f'при запросе id локаций города {error}'))
-        return False, results
-    finally:
         return is_ok_request_status, results
-
-
-@logger.catch
-def _sort_hotels_from_high_to_low(
-    hotels: List[Tuple[str, float]],
-        limit: int = 10) -> List[Tuple[str, float]]:
-    '''Сортировка отелей по убыванию цены'''
-    return sorted(
-        hotels, key=lambda hotel: hotel[2], reverse=True
-    )[:limit]
-
-
-@logger.catch
-def _sort_hotels_by_distance_limit(
-    hotels: List[Tuple[str, float]],
-        distance: int,
-        limit: int = 10, ) -> List[Tuple[str, float]]:
-    '''Сортировка отелей по убыванию дистанции от центра города'''
-    hotels = list(filter(lambda hotel: hotel[3] < distance, hotels))
-    hotels = sorted(hotels, key=lambda x: (x[2], x[3]))
-    return hotels[:limit]
+    if results:
+        cities_cache.set(cache_key, results)
+    return is_ok_request_status, results
 
 
 @logger.catch
@@ -119,10 +135,163 @@ def search_hotels_for_location(
         payload['resultsSize'] = 200
     elif command == '/bestdeals':
         payload['sort'] = 'DISTANCE'
-        payload['resultsSize'] = 200
+        payload['resultsSize'] = config.HOTEL_LIST_PAGE_SIZE
         payload['filters']['price'] = {"max": high_price, "min": low_price}
     else:
         return False, []
+    if command == '/low':
+        return _fetch_hotels_list(payload)
+    index_key = (str(region_id), checkInDate.isoformat(),
+                 checkOutDate.isoformat())
+    hotel_index = hotel_indexes.get(index_key)
+    if hotel_index is None or not _can_answer(
+            hotel_index, command, distance, low_price, high_price):
+        if command == '/bestdeals':
+            is_ok_request_status, parser_responce_hotels, is_complete = (
+                _fetch_hotels_within_distance(payload, distance))
+        else:
+            is_ok_request_status, parser_responce_hotels = (
+                _fetch_hotels_list(payload))
+            is_complete = (
+                len(parser_responce_hotels) < payload['resultsSize'])
+        if not is_ok_request_status:
+            return False, []
+        price_filter = payload['filters'].get('price', {})
+        hotel_index = HotelIndex(
+            parser_responce_hotels,
+            sort=payload.get('sort'),
+            price_min=price_filter.get('min'),
+            price_max=price_filter.get('max'),
+            is_complete=is_complete
+        )
+        hotel_indexes.set(index_key, hotel_index)
+    else:
+        logger.debug(f'Отели региона {region_id} получены из индекса')
+    if command == '/high':
+        return True, hotel_index.highest_price(limit)
+    return True, hotel_index.best_deals(distance, low_price, high_price,
+                                        limit)
+
+
+def _can_answer(hotel_index: HotelIndex,
+                command: str,
+                distance: int,
+                low_price: int,
+                high_price: int) -> bool:
+    if command == '/high':
+        return hotel_index.can_answer_highest_price()
+    return hotel_index.can_answer_best_deals(distance, low_price, high_price)
+
+
+def iter_hotels_pages(
+        payload: Dict,
+        page_size: int = config.HOTEL_LIST_PAGE_SIZE,
+        max_page_size: int = config.HOTEL_LIST_MAX_PAGE_SIZE,
+        max_results: int = config.HOTEL_LIST_MAX_RESULTS,
+        is_last_page: Optional[Callable[[List], bool]] = None,
+        estimate_results: Optional[Callable[[int, List], int]] = None
+) -> Iterator[Tuple[bool, List]]:
+    '''
+    Постраничное получение списка отелей по мере чтения.
+    Возвращает пары (статус запроса, отели страницы). Пока читается
+    текущая страница, следующая запрашивается в фоне. Страницы
+    заканчиваются на неполной странице, после max_results отелей,
+    после ошибки запроса или когда is_last_page(страница) вернет True.
+    Размер следующей страницы - до оценки нужного числа отелей
+    estimate_results(получено отелей, страница), без оценки он
+    удваивается. Размер ограничен page_size и max_page_size.
+    '''
+    def fetch_page(start: int, size: int) -> Tuple[bool, List]:
+        return _fetch_hotels_list(
+            payload | {'resultsStartingIndex': start, 'resultsSize': size})
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    next_page = None
+    try:
+        start = payload.get('resultsStartingIndex', 0)
+        size = min(page_size, max_results)
+        is_ok_request_status, hotels = fetch_page(start, size)
+        while True:
+            start += size
+            is_next_page_needed = (
+                is_ok_request_status
+                and len(hotels) == size
+                and start < max_results
+                and not (is_last_page and is_last_page(hotels)))
+            if is_next_page_needed:
+                if estimate_results is not None:
+                    size = max(estimate_results(start, hotels) - start,
+                               page_size)
+                else:
+                    size *= 2
+                size = min(size, max_page_size, max_results - start)
+                next_page = executor.submit(
+                    contextvars.copy_context().run, fetch_page, start, size)
+            yield is_ok_request_status, hotels
+            if not is_next_page_needed:
+                return
+            is_ok_request_status, hotels = next_page.result()
+            next_page = None
+    finally:
+        if next_page is not None:
+            next_page.cancel()
+        executor.shutdown(wait=False)
+
+
+def _fetch_hotels_within_distance(payload: Dict,
+                                  distance: float) -> Tuple[bool, List, bool]:
+    '''
+    Получение отелей, отсортированных по расстоянию, до первой
+    страницы, на которой есть отели дальше distance. Возвращает
+    статус, отели и признак того, что получены все отели по запросу.
+    '''
+    def estimate_results(hotels_count: int, page: List) -> int:
+        # Отели распределены по расстоянию примерно равномерно
+        last_distance = page[-1].distance
+        if last_distance <= 0:
+            return 0
+        return math.ceil(hotels_count * distance / last_distance
+                         * config.HOTEL_LIST_ESTIMATE_MARGIN)
+
+    hotels = []
+    for is_ok_request_status, page in iter_hotels_pages(
+            payload,
+            is_last_page=lambda page: page[-1].distance >= distance,
+            estimate_results=estimate_results):
+        if not is_ok_request_status:
+            return False, [], False
+        hotels.extend(page)
+    # Страницы закончились не на расстоянии и не на лимите отелей
+    is_complete = (len(hotels) < config.HOTEL_LIST_MAX_RESULTS
+                   and not (hotels and hotels[-1].distance >= distance))
+    logger.debug(f'Получено {len(hotels)} отелей до {distance} км')
+    return True, hotels, is_complete
+
+
+def _fetch_hotels_list(payload: Dict) -> Tuple[bool, List]:
+    '''
+    Получение списка отелей по параметрам запроса.
+    Ответы кэшируются по нормализованным параметрам, одновременные
+    одинаковые запросы выполняются одним обращением к API.
+    Если API недоступно, отдается устаревший ответ из кэша.
+    '''
+    cache_key = json.dumps(payload, sort_keys=True)
+    cached_hotels = search_cache.get(cache_key)
+    if cached_hotels is not None:
+        logger.debug('Список отелей получен из кэша')
+        return True, list(cached_hotels)
+    is_ok_request_status, hotels = search_flight.do(
+        cache_key, _request_hotels_list, payload, cache_key)
+    if not is_ok_request_status:
+        stale_hotels = search_cache.get_stale(cache_key)
+        if stale_hotels is not None:
+            logger.warning('API недоступно, список отелей взят из кэша')
+            return True, list(stale_hotels)
+    return is_ok_request_status, list(hotels)
+
+
+def _request_hotels_list(payload: Dict, cache_key: str) -> Tuple[bool, List]:
+    '''Запрос списка отелей к API и разбор ответа'''
     is_ok_request_status, request_data = make_api_request(
         method_endswith=API_SETTINGS.ENDPOINTS['list'],
         method_type='POST',
@@ -130,38 +299,17 @@ def search_hotels_for_location(
         headers=API_SETTINGS.HEADERS | {"content-type": "application/json"},
         params=[]
     )
+    if not is_ok_request_status:
+        return False, []
     try:
-        if is_ok_request_status:
-            parser_responce_hotels = []
-            hotels = request_data['data']['propertySearch']['properties']
-            for hotel_item in hotels:
-                parser_responce_hotels.append(
-                    (
-                        hotel_item['id'],
-                        hotel_item['name'],
-                        round(hotel_item['price']['lead']['amount'], 2),
-                        (hotel_item['destinationInfo']
-                         ['distanceFromDestination']
-                         ['value'])
-                    )
-                )
-            if command == '/high':
-                parser_responce_hotels = _sort_hotels_from_high_to_low(
-                    hotels=parser_responce_hotels,
-                    limit=limit)
-            elif command == '/bestdeals':
-                parser_responce_hotels = _sort_hotels_by_distance_limit(
-                    hotels=parser_responce_hotels,
-                    distance=distance,
-                    limit=limit)
-            return True, parser_responce_hotels
-        else:
-            return False, []
+        parser_responce_hotels = parsers.parse_hotels_list(request_data)
     except (KeyError, TypeError):
         logger.exception(
             ('Ошибка при разборе JSON ответа от '
              f'{API_SETTINGS.ENDPOINTS["list"]}, ключ не найден.'))
         return False, []
+    search_cache.set(cache_key, parser_responce_hotels)
+    return True, parser_responce_hotels
 
 
 @logger.catch
@@ -189,110 +337,118 @@ def get_hotel_details(hotel_id: str,
     )
     if not is_request_complted:
         return False, '', []
+    hotel_detail = parsers.parse_hotel_detail(
+        request_data, image_limit if is_images_needed else 0)
+    return True, hotel_detail.address or 'не найден', list(hotel_detail.images)
+
+
+def iter_hotels_details(hotels: List[HotelResult],
+                        is_images_needed: bool = False,
+                        image_limit=None,
+                        max_workers: int = None
+                        ) -> Iterator[Tuple[int, bool, HotelResult]]:
+    '''
+    Получение дополнительных сведений о нескольких отелях по мере
+    готовности. Возвращает тройки (индекс отеля в hotels, статус,
+    отель с адресом и фотографиями).
+    Свежие сведения берутся из базы и отдаются сразу, остальные
+    запрашиваются параллельно и сохраняются в базу фоновым потоком
+    history_writer.
+    Ошибка по одному отелю не влияет на остальные.
+    '''
+    if not hotels:
+        return
+    image_limit = image_limit if is_images_needed else 0
+    cached_details = CRUD.get_fresh_hotels_details(
+        hotels_ids=[hotel.id for hotel in hotels],
+        max_age=config.HOTEL_DETAILS_CACHE_TTL
+    ) or {}
+    missing_indexes = []
+    for index, hotel in enumerate(hotels):
+        if str(hotel.id) not in cached_details:
+            missing_indexes.append(index)
+            continue
+        address, images_links = cached_details[str(hotel.id)]
+        yield index, True, hotel._replace(
+            address=address, images=tuple(images_links[:image_limit]))
+    logger.debug(
+        (f'Сведения {len(hotels) - len(missing_indexes)} отелей получены '
+         f'из базы, {len(missing_indexes)} будут запрошены'))
+    if not missing_indexes:
+        return
+
+    def fetch(hotel_id: str) -> Tuple[bool, str, List]:
+        result = get_hotel_details(
+            hotel_id=hotel_id,
+            is_images_needed=True,
+            image_limit=config.HOTEL_PHOTOS_LIMIT
+        )
+        if result is None:
+            return False, '', []
+        return result
+
+    fetched_hotels = []
+    max_workers = max_workers or config.HOTEL_DETAILS_MAX_WORKERS
+    workers_count = min(max_workers, len(missing_indexes))
     try:
-        address = (request_data['data']
-                   ['propertyInfo']
-                   ['summary']
-                   ['location']
-                   ['address']
-                   ['addressLine'])
-    except (KeyError, TypeError):
-        logger.exception(
-            (f'Ошибка при разборе адресса JSON ответа '
-             '{API_SETTINGS.ENDPOINTS["list"]}, ключ не найден.'))
-        address = 'не найден'
-    images_links = []
-    if is_images_needed:
-        try:
-            images = (request_data['data']['propertyInfo']
-                      ['propertyGallery']['images'][:image_limit])
-            for item in images:
-                images_links.append(item['image']['url'])
-        except (KeyError, TypeError):
-            logger.exception(
-                ('Ошибка при разборе фотографий JSON ответа '
-                 f'{API_SETTINGS.ENDPOINTS["list"]}, ключ не найден.'))
-    return True, address, images_links
+        with ThreadPoolExecutor(max_workers=workers_count) as executor:
+            # Копия контекста, чтобы запросы попали в трассировку диалога
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run, fetch, hotels[index].id
+                ): index
+                for index in missing_indexes
+            }
+            for future in as_completed(futures):
+                index = futures[future]
+                is_ok_status, address, images_links = future.result()
+                hotel = hotels[index]._replace(
+                    address=address, images=tuple(images_links))
+                if is_ok_status:
+                    fetched_hotels.append(hotel)
+                else:
+                    is_ok_status, hotel = _get_stale_hotel_details(hotel)
+                yield index, is_ok_status, hotel._replace(
+                    images=hotel.images[:image_limit])
+    finally:
+        history_writer.submit_hotels_details(fetched_hotels)
+
+
+def _get_stale_hotel_details(
+        hotel: HotelResult) -> Tuple[bool, HotelResult]:
+    '''Сведения об отеле из базы не старше HOTEL_DETAILS_STALE_TTL'''
+    stale_details = CRUD.get_fresh_hotels_details(
+        hotels_ids=[hotel.id],
+        max_age=config.HOTEL_DETAILS_STALE_TTL
+    ) or {}
+    if str(hotel.id) not in stale_details:
+        return False, hotel
+    logger.warning(f'Сведения отеля {hotel.id} взяты из базы без обновления')
+    address, images_links = stale_details[str(hotel.id)]
+    return True, hotel._replace(address=address, images=tuple(images_links))
+
+
+def is_service_available(endpoint_name: str = 'list') -> bool:
+    '''
+    False, пока запросы к точке API отключены после ошибок
+    и ответ пользователю лучше не ждать
+    '''
+    return http_client.get_client().is_available(
+        API_SETTINGS.ENDPOINTS[endpoint_name])
 
 
 @logger.catch
-def make_api_request(method_endswith: Dict,
+def make_api_request(method_endswith: str,
                      method_type: str,
                      headers: Dict,
                      params: Dict,
                      json: Dict
                      ) -> Tuple[bool, Dict]:
-    '''Выполнение запроса к API сервису сайта'''
-    url = f"https://{config.RAPID_API_HOST}/{method_endswith}"
+    '''Выполнение запроса к API сервису сайта через общий клиент'''
+    client = http_client.get_client()
     if method_type == 'GET':
-        return make_get_request(
-            url=url,
-            params=params,
-            headers=headers
-        )
+        return client.get(method_endswith, params=params, headers=headers)
     elif method_type == 'POST':
-        return make_post_request(
-            url=url,
-            json=json,
-            headers=headers
-        )
+        return client.post(method_endswith, json=json, headers=headers)
     else:
         return False, {}
-
-
-@logger.catch
-def make_get_request(
-        url: str,
-        params: Dict,
-        headers: Dict) -> Tuple[bool, Dict]:
-    '''Выполнение GET запроса'''
-    try:
-        response = requests.get(
-            url,
-            headers=headers,
-            params=params,
-            timeout=API_SETTINGS.TIMEOUT
-        )
-        if response.status_code == requests.codes.ok:
-            logger.debug(
-                (f'GET запрос {url} успешно выполнен. '
-                 f'Получен код {response.status_code}'))
-            return True, response.json()
-        else:
-            logger.error(
-                ('Ошибка, не получен код успешного запроса. '
-                 f'Получен {response.status_code} при GET запросe {url}'))
-            return False, response.status_code
-    except Exception as error:
-        logger.exception(
-            f'Ошибка при GET запросe {url} {error}')
-        return False, {}
-
-
-def make_post_request(
-        url: str,
-        json: Dict,
-        headers: Dict
-) -> Tuple[bool, Dict]:
-    '''Выполнение POST запроса'''
-    try:
-        response = requests.post(
-            url,
-            headers=headers,
-            json=json,
-            timeout=API_SETTINGS.TIMEOUT
-        )
-        if response.status_code == requests.codes.ok:
-            logger.debug(
-                (f'POST запрос {url} успешно выполнен. '
-                 f'Получен код {response.status_code}'))
-            return True, response.json()
-        else:
-            logger.debug(
-                ('Ошибка, не получен код успешного запроса.'
-                 f'Получен {response.status_code} при POST запросe {url}'))
-            return False, {}
-    except Exception as error:
-        logger.exception(
-            f'Ошибка при POST запросe {url}\n{error}')
-        return False, {}
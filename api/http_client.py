@@ -0,0 +1,268 @@
+import random
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from loguru import logger
+from requests.adapters import HTTPAdapter
+
+from api import parsers
+from api.resilience import AdaptiveConcurrencyLimiter, CircuitBreaker
+from config_data import config
+from utils.misc.metrics import API_ERRORS, API_REQUEST_DURATION
+from utils.misc.tracing import tracer
+
+
+class ApiClient:
+    '''
+    HTTP клиент для API сервиса сайта.
+    Хранит пул keep-alive соединений к хосту и повторяет запросы
+    с экспоненциальной задержкой и джиттером при ответах 429/5xx.
+    Для каждой точки API (endpoint) ведет CircuitBreaker и адаптивный
+    лимит одновременных запросов: пока API недоступно или перегружено,
+    запросы сразу завершаются неудачей вместо ожидания timeout.
+    Для CircuitBreaker ошибкой считается запрос, неудачный после всех
+    повторов или выполнявшийся дольше latency_threshold секунд.
+    '''
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self,
+                 base_url: str,
+                 headers: Optional[Dict] = None,
+                 pool_size: int = config.HTTP_POOL_SIZE,
+                 max_retries: int = config.HTTP_MAX_RETRIES,
+                 backoff_factor: float = config.HTTP_BACKOFF_FACTOR,
+                 backoff_max: float = config.HTTP_BACKOFF_MAX,
+                 timeout: float = config.REQUESTS_TIMEOUT,
+                 failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout: float = config.CIRCUIT_RECOVERY_TIMEOUT,
+                 max_concurrency: int = config.API_MAX_CONCURRENCY,
+                 endpoint_concurrency: Optional[Dict[str, int]] = None,
+                 latency_threshold: float = config.API_LATENCY_THRESHOLD,
+                 queue_timeout: float = config.API_QUEUE_TIMEOUT) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.max_concurrency = max_concurrency
+        self.endpoint_concurrency = (
+            config.API_ENDPOINT_MAX_CONCURRENCY
+            if endpoint_concurrency is None else endpoint_concurrency)
+        self.latency_threshold = latency_threshold
+        self.queue_timeout = queue_timeout
+        self._guards: Dict[
+            str, Tuple[CircuitBreaker, AdaptiveConcurrencyLimiter]] = {}
+        self._guards_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size
+        )
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _get_retry_delay(self,
+                         attempt: int,
+                         response: Optional[requests.Response] = None
+                         ) -> float:
+        '''Задержка перед повтором: Retry-After или backoff с джиттером'''
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(float(retry_after), self.backoff_max)
+        delay = min(self.backoff_max, self.backoff_factor * 2 ** attempt)
+        return random.uniform(0, delay)
+
+    def get_guard(self, endpoint: str
+                  ) -> Tuple[CircuitBreaker, AdaptiveConcurrencyLimiter]:
+        '''CircuitBreaker и лимит одновременных запросов точки API'''
+        guard = self._guards.get(endpoint)
+        if guard is None:
+            with self._guards_lock:
+                guard = self._guards.get(endpoint)
+                if guard is None:
+                    max_concurrency = self.endpoint_concurrency.get(
+                        endpoint, self.max_concurrency)
+                    guard = self._guards[endpoint] = (
+                        CircuitBreaker(
+                            endpoint,
+                            failure_threshold=self.failure_threshold,
+                            recovery_timeout=self.recovery_timeout),
+                        AdaptiveConcurrencyLimiter(
+                            endpoint,
+                            initial_limit=max_concurrency,
+                            max_limit=max_concurrency,
+                            latency_threshold=self.latency_threshold)
+                    )
+        return guard
+
+    def is_available(self, endpoint: str) -> bool:
+        '''False, пока запросы к точке API отключены CircuitBreaker'''
+        breaker, _ = self.get_guard(endpoint)
+        return breaker.state != CircuitBreaker.OPEN
+
+    def request(self,
+                method: str,
+                endpoint: str,
+                params: Optional[Dict] = None,
+                json: Optional[Dict] = None,
+                headers: Optional[Dict] = None) -> Tuple[bool, Dict]:
+        '''
+        Выполнение запроса с повтором при временных ошибках.
+        Запрос сразу отклоняется, если точка API отключена
+        CircuitBreaker или за queue_timeout не нашлось места в лимите
+        одновременных запросов.
+        '''
+        breaker, limiter = self.get_guard(endpoint)
+        if not breaker.allow_request():
+            API_ERRORS.inc(endpoint=endpoint, status='circuit_open')
+            logger.warning(
+                f'Запрос к {endpoint} отклонен: запросы отключены '
+                'после ошибок API')
+            return False, {}
+        if not limiter.acquire(self.queue_timeout):
+            # Пробный запрос half_open будет разрешен снова
+            # через recovery_timeout
+            API_ERRORS.inc(endpoint=endpoint, status='overloaded')
+            logger.warning(
+                f'Запрос к {endpoint} отклонен: занято {limiter.limit} '
+                'мест лимита одновременных запросов')
+            return False, {}
+        latency = None
+        is_ok_request_status = False
+        try:
+            started_at = time.perf_counter()
+            with tracer.span(f'api {endpoint}', method=method), \
+                    API_REQUEST_DURATION.timer(endpoint=endpoint):
+                is_ok_request_status, data = self._request_with_retries(
+                    method, endpoint, params, json, headers, breaker)
+            latency = time.perf_counter() - started_at
+            if is_ok_request_status:
+                # Слишком медленный ответ для CircuitBreaker - ошибка
+                if latency > self.latency_threshold:
+                    breaker.record_failure()
+                else:
+                    breaker.record_success()
+            return is_ok_request_status, data
+        finally:
+            limiter.release(latency, is_ok_request_status)
+
+    def _request_with_retries(self,
+                              method: str,
+                              endpoint: str,
+                              params: Optional[Dict],
+                              json: Optional[Dict],
+                              headers: Optional[Dict],
+                              breaker: CircuitBreaker) -> Tuple[bool, Dict]:
+        url = f'{self.base_url}/{endpoint}'
+        for attempt in range(self.max_retries + 1):
+            is_last_attempt = attempt == self.max_retries
+            if attempt and breaker.state != CircuitBreaker.CLOSED:
+                # Точка API отключена во время повторов или запрос
+                # пробный: повторы только продлили бы ожидание.
+                # Неудачная проба снова отключает точку API
+                breaker.record_failure()
+                return False, {}
+            try:
+                response = self.session.request(
+                    method,
+                    url,
+                    params=params,
+                    json=json,
+                    headers=headers,
+                    timeout=self.timeout
+                )
+            except requests.ConnectionError as error:
+                API_ERRORS.inc(endpoint=endpoint, status='connection')
+                if is_last_attempt:
+                    breaker.record_failure()
+                    logger.exception(
+                        f'Ошибка при {method} запросe {url} {error}')
+                    return False, {}
+                logger.warning(
+                    f'Ошибка соединения при {method} запросe {url}, '
+                    f'попытка {attempt + 1}: {error}')
+                time.sleep(self._get_retry_delay(attempt))
+                continue
+            except requests.RequestException as error:
+                API_ERRORS.inc(endpoint=endpoint, status='request')
+                breaker.record_failure()
+                logger.exception(
+                    f'Ошибка при {method} запросe {url} {error}')
+                return False, {}
+            if response.status_code == requests.codes.ok:
+                logger.debug(
+                    (f'{method} запрос {url} успешно выполнен. '
+                     f'Получен код {response.status_code}'))
+                try:
+                    data = parsers.loads(response.content)
+                except ValueError as error:
+                    API_ERRORS.inc(endpoint=endpoint, status='invalid_json')
+                    breaker.record_failure()
+                    logger.exception(
+                        f'Ошибка разбора JSON ответа {url} {error}')
+                    return False, {}
+                return True, data
+            API_ERRORS.inc(endpoint=endpoint, status=response.status_code)
+            if (response.status_code in self.RETRY_STATUSES
+                    and not is_last_attempt):
+                delay = self._get_retry_delay(attempt, response)
+                logger.warning(
+                    (f'Получен {response.status_code} при {method} '
+                     f'запросe {url}, повтор через {delay:.2f}с'))
+                time.sleep(delay)
+                continue
+            if response.status_code in self.RETRY_STATUSES:
+                breaker.record_failure()
+            else:
+                # API отвечает, ошибка в самом запросе
+                breaker.record_success()
+            logger.error(
+                ('Ошибка, не получен код успешного запроса. '
+                 f'Получен {response.status_code} при {method} запросe {url}'))
+            return False, {}
+        return False, {}
+
+    def get(self, endpoint: str, params: Optional[Dict] = None,
+            headers: Optional[Dict] = None) -> Tuple[bool, Dict]:
+        '''Выполнение GET запроса'''
+        return self.request('GET', endpoint, params=params, headers=headers)
+
+    def post(self, endpoint: str, json: Optional[Dict] = None,
+             headers: Optional[Dict] = None) -> Tuple[bool, Dict]:
+        '''Выполнение POST запроса'''
+        return self.request('POST', endpoint, json=json, headers=headers)
+
+    def close(self) -> None:
+        '''Закрытие всех соединений пула'''
+        self.session.close()
+
+
+_client: Optional[ApiClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> ApiClient:
+    '''Возвращает общий клиент, создавая его при первом обращении'''
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = ApiClient(f'https://{config.RAPID_API_HOST}')
+    return _client
+
+
+def set_client(client: ApiClient) -> Optional[ApiClient]:
+    '''
+    Подмена общего клиента, например на клиент к локальному
+    тестовому серверу. Возвращает предыдущий клиент.
+    '''
+    global _client
+    with _client_lock:
+        previous_client, _client = _client, client
+    return previous_client
@@ -0,0 +1,81 @@
+'''
+Разбор ответов API сервиса сайта.
+Из ответов properties/v2/list и properties/v2/detail берутся только
+нужные боту поля, результат - компактные записи HotelResult и
+HotelDetail вместо вложенных словарей ответа.
+JSON декодируется orjson, если он установлен, иначе модулем json.
+'''
+import json
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+from utils.misc.records import HotelResult
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class HotelDetail(NamedTuple):
+    '''Дополнительные сведения об отеле: адрес и ссылки на фотографии'''
+    address: Optional[str]
+    images: Tuple[str, ...]
+
+
+def loads(content: bytes) -> Any:
+    '''
+    Декодирование JSON ответа. Ошибка формата - ValueError
+    для обоих декодеров.
+    '''
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def parse_hotels_list(data: Dict) -> List[HotelResult]:
+    '''
+    Отели ответа properties/v2/list.
+    При отсутствии нужных полей - KeyError или TypeError.
+    '''
+    return [
+        HotelResult(
+            item['id'],
+            item['name'],
+            round(item['price']['lead']['amount'], 2),
+            item['destinationInfo']['distanceFromDestination']['value']
+        )
+        for item in data['data']['propertySearch']['properties']
+    ]
+
+
+def parse_hotel_detail(data: Dict,
+                       images_limit: Optional[int] = None) -> HotelDetail:
+    '''
+    Адрес и первые images_limit фотографий из ответа
+    properties/v2/detail. Без адреса в ответе address равен None,
+    без галереи список фотографий пуст.
+    '''
+    try:
+        property_info = data['data']['propertyInfo']
+    except (KeyError, TypeError):
+        logger.exception('Ошибка при разборе JSON ответа, ключ не найден.')
+        return HotelDetail(None, ())
+    try:
+        address = (property_info['summary']['location']
+                   ['address']['addressLine'])
+    except (KeyError, TypeError):
+        logger.exception(
+            'Ошибка при разборе адресса JSON ответа, ключ не найден.')
+        address = None
+    try:
+        images = tuple(
+            item['image']['url']
+            for item in (property_info['propertyGallery']
+                         ['images'][:images_limit]))
+    except (KeyError, TypeError):
+        logger.exception(
+            'Ошибка при разборе фотографий JSON ответа, ключ не найден.')
+        images = ()
+    return HotelDetail(address, images)
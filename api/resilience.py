@@ -0,0 +1,186 @@
+'''
+Защита бота от деградации API сервиса сайта.
+CircuitBreaker отключает запросы к точке API, когда среди последних
+запросов много ошибок, и через recovery_timeout пропускает пробный
+запрос.
+AdaptiveConcurrencyLimiter ограничивает число одновременных запросов
+к точке API и подстраивает лимит по задержке и ошибкам (AIMD):
+после удачного быстрого запроса лимит растет на 1 / лимит, после
+ошибки или медленного ответа уменьшается в backoff_ratio раз, но не
+чаще одного раза за время запроса, как окно в TCP.
+'''
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Optional
+
+from loguru import logger
+
+from config_data import config
+
+
+class CircuitBreaker:
+    '''
+    Автомат состояний closed - open - half_open для одной точки API.
+    closed: запросы выполняются, failure_threshold ошибок среди
+    последних window_size запросов переводят в open.
+    open: запросы сразу отклоняются, через recovery_timeout секунд -
+    half_open. half_open: выполняется один пробный запрос, успех
+    возвращает в closed, ошибка - снова в open.
+    '''
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self,
+                 name: str,
+                 failure_threshold: int = config.CIRCUIT_FAILURE_THRESHOLD,
+                 window_size: int = config.CIRCUIT_WINDOW_SIZE,
+                 recovery_timeout: float = config.CIRCUIT_RECOVERY_TIMEOUT,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        # Результаты последних запросов, True - ошибка
+        self._outcomes: Deque[bool] = deque(maxlen=window_size)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _update_state(self, now: float) -> None:
+        if (self._state == self.OPEN
+                and now - self._opened_at >= self.recovery_timeout):
+            self._state = self.HALF_OPEN
+            self._probe_started_at = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._update_state(self.clock())
+            return self._state
+
+    def allow_request(self) -> bool:
+        '''
+        Можно ли выполнить запрос. В half_open разрешается один
+        пробный запрос, повторный - если проба не завершилась
+        за recovery_timeout.
+        '''
+        with self._lock:
+            now = self.clock()
+            self._update_state(now)
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN:
+                return False
+            if (self._probe_started_at is not None
+                    and now - self._probe_started_at < self.recovery_timeout):
+                return False
+            self._probe_started_at = now
+            return True
+
+    @property
+    def failures(self) -> int:
+        '''Число ошибок среди последних запросов'''
+        return sum(self._outcomes)
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state == self.CLOSED:
+                self._outcomes.append(False)
+                return
+            if self._state == self.HALF_OPEN:
+                logger.info(f'Запросы к {self.name} восстановлены')
+                self._state = self.CLOSED
+                self._outcomes.clear()
+                self._probe_started_at = None
+
+    def record_failure(self) -> None:
+        with self._lock:
+            now = self.clock()
+            self._update_state(now)
+            if self._state == self.OPEN:
+                return
+            self._outcomes.append(True)
+            if self._state == self.HALF_OPEN or (
+                    sum(self._outcomes) >= self.failure_threshold):
+                logger.warning(
+                    f'Запросы к {self.name} отключены на '
+                    f'{self.recovery_timeout}с после '
+                    f'{sum(self._outcomes)} ошибок из '
+                    f'{len(self._outcomes)} запросов')
+                self._state = self.OPEN
+                self._opened_at = now
+                self._outcomes.clear()
+                self._probe_started_at = None
+
+
+class AdaptiveConcurrencyLimiter:
+    '''
+    Лимит одновременных запросов к точке API с аддитивным ростом
+    и мультипликативным уменьшением. Запрос, не получивший места
+    за timeout секунд, отклоняется.
+    '''
+
+    def __init__(self,
+                 name: str,
+                 initial_limit: float = config.API_MAX_CONCURRENCY,
+                 min_limit: float = config.API_MIN_CONCURRENCY,
+                 max_limit: float = config.API_MAX_CONCURRENCY,
+                 latency_threshold: float = config.API_LATENCY_THRESHOLD,
+                 backoff_ratio: float = 0.5) -> None:
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.backoff_ratio = backoff_ratio
+        self._limit = float(initial_limit)
+        self._decreased_at = 0.0
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return max(1, int(self._limit))
+
+    def acquire(self, timeout: float) -> bool:
+        '''Занятие места для запроса, False - места нет за timeout'''
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self.in_flight >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self,
+                latency: Optional[float] = None,
+                is_ok: bool = True) -> None:
+        '''
+        Освобождение места и подстройка лимита по задержке
+        и результату запроса. Без latency лимит не меняется.
+        '''
+        with self._condition:
+            self.in_flight -= 1
+            if latency is not None:
+                now = time.monotonic()
+                if not is_ok or latency > self.latency_threshold:
+                    # Запросы, начатые до прошлого снижения, лимит
+                    # повторно не снижают
+                    if now - latency >= self._decreased_at:
+                        self._decrease(now)
+                else:
+                    self._limit = min(self.max_limit,
+                                      self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def _decrease(self, now: float) -> None:
+        limit = max(self.min_limit, self._limit * self.backoff_ratio)
+        if int(limit) < int(self._limit):
+            logger.warning(
+                f'Лимит запросов к {self.name} снижен до {int(limit)}')
+        self._limit = limit
+        self._decreased_at = now
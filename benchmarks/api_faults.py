@@ -0,0 +1,282 @@
+'''
+Проверка поведения бота при деградации API сервиса сайта с
+внедрением ошибок в локальную заглушку (benchmarks.fake_servers).
+Потоки ищут отели (/low) по небольшому набору регионов, каждый
+поиск обращается к API, а при ошибке может быть отдан устаревший
+ответ прошлого поиска из кэша. Заглушка проходит фазы: норма,
+деградация (задержка и доля ответов 429/500/503), восстановление.
+Сценарий выполняется с защитой (CircuitBreaker и адаптивный лимит
+ApiClient) и без нее.
+Второй сценарий - исправное, но медленное API: --dialogs диалогов
+одновременно запрашивают сведения о 15 отелях в
+HOTEL_DETAILS_MAX_WORKERS потоков, как final_step, при лимите точки
+properties/v2/detail из API_ENDPOINT_MAX_CONCURRENCY и при общем
+лимите API_MAX_CONCURRENCY. Выводит долю запросов, отклоненных
+лимитом, и p50/p95 длительности получения сведений на диалог.
+
+Для каждой фазы выводит число поисков, долю успешных (с учетом
+ответов из устаревшего кэша), p50/p95 длительности поиска и число
+запросов, дошедших до API. Проверяет, что с защитой поиск во время
+деградации завершается быстрее, чем без нее, а после восстановления
+запросы к API возобновляются, а сведения об отелях при медленном API
+не отклоняются лимитом. При невыполнении проверок код выхода 1.
+
+Запуск из корня проекта:
+    python -m benchmarks.api_faults --workers 20 --phase-duration 4
+'''
+import argparse
+import datetime
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+PHASES = ('норма', 'деградация', 'восстановление')
+
+
+def run_scenario(args: argparse.Namespace,
+                 is_guarded: bool) -> Dict[str, Dict[str, float]]:
+    '''Прогон фаз сценария, статистика поисков по фазам'''
+    from api import http_client, hotels_service
+    from benchmarks.dialogs import percentile
+    from benchmarks.fake_servers import FakeHotelsApiServer
+
+    api_server = FakeHotelsApiServer(
+        latency=args.api_latency, seed=1).start()
+    if is_guarded:
+        client = http_client.ApiClient(
+            api_server.url,
+            backoff_factor=0.05,
+            timeout=args.timeout,
+            recovery_timeout=args.recovery_timeout,
+            latency_threshold=args.latency_threshold,
+            queue_timeout=args.queue_timeout)
+    else:
+        client = http_client.ApiClient(
+            api_server.url,
+            backoff_factor=0.05,
+            timeout=args.timeout,
+            failure_threshold=10 ** 9,
+            max_concurrency=10 ** 6)
+    http_client.set_client(client)
+    # Каждый поиск идет в API, ответы прошлых поисков доступны
+    # только как устаревшие
+    hotels_service.search_cache.clear()
+    hotels_service.search_cache.ttl = 0
+
+    check_in = datetime.date.today() + datetime.timedelta(days=30)
+    check_out = check_in + datetime.timedelta(days=2)
+    results: List[Tuple[str, float, bool]] = []
+    results_lock = threading.Lock()
+    phase = {'name': PHASES[0]}
+    stop_event = threading.Event()
+
+    def worker(number: int) -> None:
+        iteration = 0
+        while not stop_event.is_set():
+            region_id = str((number * 7 + iteration) % args.regions)
+            iteration += 1
+            phase_name = phase['name']
+            started_at = time.perf_counter()
+            is_ok, hotels = hotels_service.search_hotels_for_location(
+                region_id=region_id,
+                limit=5,
+                checkInDate=check_in,
+                checkOutDate=check_out,
+                command='/low') or (False, [])
+            duration = time.perf_counter() - started_at
+            with results_lock:
+                results.append((phase_name, duration, bool(is_ok)))
+            time.sleep(args.think_time)
+
+    threads = [threading.Thread(target=worker, args=(number,), daemon=True)
+               for number in range(args.workers)]
+    for thread in threads:
+        thread.start()
+    api_calls = {}
+    for phase_name in PHASES:
+        if phase_name == 'деградация':
+            api_server.latency = args.fault_latency
+            api_server.error_rate = args.fault_error_rate
+        else:
+            api_server.latency = args.api_latency
+            api_server.error_rate = 0.0
+        calls_before = sum(api_server.calls.values())
+        phase['name'] = phase_name
+        time.sleep(args.phase_duration)
+        api_calls[phase_name] = sum(api_server.calls.values()) - calls_before
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    api_server.stop()
+    client.close()
+
+    durations = defaultdict(list)
+    successes = defaultdict(int)
+    for phase_name, duration, is_ok in results:
+        durations[phase_name].append(duration)
+        successes[phase_name] += is_ok
+    return {
+        phase_name: {
+            'searches': len(durations[phase_name]),
+            'ok': successes[phase_name] / max(1, len(durations[phase_name])),
+            'p50': percentile(durations[phase_name], 50),
+            'p95': percentile(durations[phase_name], 95),
+            'api_calls': api_calls[phase_name],
+        }
+        for phase_name in PHASES
+    }
+
+
+def run_details_scenario(args: argparse.Namespace,
+                         detail_limit: int) -> Dict[str, float]:
+    '''
+    Диалоги, запрашивающие сведения об отелях при исправном медленном
+    API, статистика запросов и длительности диалогов
+    '''
+    from api import http_client, hotels_service
+    from benchmarks.dialogs import percentile
+    from benchmarks.fake_servers import FakeHotelsApiServer
+    from config_data import config
+
+    api_server = FakeHotelsApiServer(
+        latency=args.detail_latency, jitter=args.detail_latency / 3,
+        seed=1).start()
+    detail_endpoint = hotels_service.API_SETTINGS.ENDPOINTS['detail']
+    client = http_client.ApiClient(
+        api_server.url,
+        endpoint_concurrency={detail_endpoint: detail_limit})
+    http_client.set_client(client)
+
+    durations: List[float] = []
+    requests_statuses: List[bool] = []
+    results_lock = threading.Lock()
+    stop_event = threading.Event()
+
+    def fetch(hotel_id: str) -> bool:
+        is_ok_status, _, _ = hotels_service.get_hotel_details(
+            hotel_id=hotel_id,
+            is_images_needed=True,
+            image_limit=config.HOTEL_PHOTOS_LIMIT)
+        return is_ok_status
+
+    def dialog(number: int) -> None:
+        iteration = 0
+        with ThreadPoolExecutor(
+                max_workers=config.HOTEL_DETAILS_MAX_WORKERS) as executor:
+            while not stop_event.is_set():
+                hotels_ids = [
+                    f'{number}{iteration}{hotel_number:03}'
+                    for hotel_number in range(config.HOTEL_REQUESTS_LIMIT)]
+                iteration += 1
+                started_at = time.perf_counter()
+                statuses = list(executor.map(fetch, hotels_ids))
+                duration = time.perf_counter() - started_at
+                with results_lock:
+                    durations.append(duration)
+                    requests_statuses.extend(statuses)
+
+    threads = [threading.Thread(target=dialog, args=(number,), daemon=True)
+               for number in range(args.dialogs)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.phase_duration * 2)
+    stop_event.set()
+    for thread in threads:
+        thread.join()
+    api_server.stop()
+    client.close()
+    return {
+        'dialogs': len(durations),
+        'rejected': (requests_statuses.count(False)
+                     / max(1, len(requests_statuses))),
+        'p50': percentile(durations, 50),
+        'p95': percentile(durations, 95),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--regions', type=int, default=30)
+    parser.add_argument('--phase-duration', type=float, default=4.0)
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    parser.add_argument('--fault-latency', type=float, default=1.0)
+    parser.add_argument('--fault-error-rate', type=float, default=0.7)
+    parser.add_argument('--timeout', type=float, default=3.0,
+                        help='timeout запроса к API, секунд')
+    parser.add_argument('--recovery-timeout', type=float, default=1.0)
+    parser.add_argument('--latency-threshold', type=float, default=0.5)
+    parser.add_argument('--queue-timeout', type=float, default=0.2)
+    parser.add_argument('--think-time', type=float, default=0.05,
+                        help='пауза потока между поисками, секунд')
+    parser.add_argument('--dialogs', type=int, default=8,
+                        help='одновременных диалогов во втором сценарии')
+    parser.add_argument('--detail-latency', type=float, default=1.0,
+                        help='задержка ответа detail во втором сценарии')
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='hotels_bot_bench_'))
+
+    from loguru import logger
+
+    from config_data import config
+
+    logger.remove()
+    print(f'Потоков: {args.workers}, регионов: {args.regions}, '
+          f'фаза {args.phase_duration}с, деградация: задержка '
+          f'{args.fault_latency}с, ошибки {args.fault_error_rate:.0%}')
+    stats = {}
+    for mode, is_guarded in (('без защиты', False), ('с защитой', True)):
+        stats[mode] = run_scenario(args, is_guarded)
+        print(mode)
+        for phase_name, phase_stats in stats[mode].items():
+            print(f'{phase_name:>16}: поисков {phase_stats["searches"]}, '
+                  f'успешно {phase_stats["ok"]:.0%}, '
+                  f'p50/p95 {phase_stats["p50"]:.3f}/'
+                  f'{phase_stats["p95"]:.3f}с, '
+                  f'запросов к API {phase_stats["api_calls"]}')
+
+    print(f'Диалогов: {args.dialogs}, задержка detail '
+          f'{args.detail_latency}с')
+    details_stats = {}
+    detail_limits = (
+        ('общий лимит', config.API_MAX_CONCURRENCY),
+        ('лимит detail', config.API_ENDPOINT_MAX_CONCURRENCY[
+            'properties/v2/detail']))
+    for mode, detail_limit in detail_limits:
+        details_stats[mode] = run_details_scenario(args, detail_limit)
+        print(f'{mode:>16} ({detail_limit}): диалогов '
+              f'{details_stats[mode]["dialogs"]}, отклонено запросов '
+              f'{details_stats[mode]["rejected"]:.0%}, p50/p95 '
+              f'{details_stats[mode]["p50"]:.3f}/'
+              f'{details_stats[mode]["p95"]:.3f}с')
+
+    guarded, unguarded = stats['с защитой'], stats['без защиты']
+    checks = {
+        'с защитой поиск при деградации быстрее (p95)':
+            guarded['деградация']['p95'] < unguarded['деградация']['p95'],
+        'с защитой меньше запросов к деградировавшему API':
+            (guarded['деградация']['api_calls']
+             < unguarded['деградация']['api_calls']),
+        'после восстановления запросы к API возобновились':
+            guarded['восстановление']['api_calls'] > 0,
+        'после восстановления поиски успешны':
+            guarded['восстановление']['ok'] >= 0.9,
+        'сведения об отелях при медленном API не отклоняются':
+            details_stats['лимит detail']['rejected'] < 0.01,
+    }
+    for name, is_passed in checks.items():
+        print(f'{"OK  " if is_passed else "FAIL"} {name}')
+    if not all(checks.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+'''
+Микро-замер функций CRUD для профилей настроек базы (DATABASE_PROFILE):
+default - PRAGMA по умолчанию и подключение на каждый вызов,
+tuned - WAL, synchronous=NORMAL, mmap, кэш страниц и пул соединений.
+Каждый профиль замеряется в отдельном процессе на временной базе.
+
+Запуск из корня проекта:
+    python -m benchmarks.database_profiles --iterations 300
+'''
+import argparse
+import datetime
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from config_data import config
+
+
+def run_profile(iterations: int, hotels_count: int) -> None:
+    '''Замер операций CRUD в текущем процессе'''
+    from loguru import logger
+
+    from utils.misc.records import HotelResult
+    from database.tools import CRUD
+
+    logger.remove()
+    hotels = [
+        HotelResult(
+            id=str(number),
+            name=f'Отель {number}',
+            price=100 + number,
+            distance=number / 10,
+            address=f'Улица {number}',
+            images=(f'https://example.com/{number}.jpg',)
+        )
+        for number in range(hotels_count)
+    ]
+    hotels_ids = [hotel.id for hotel in hotels]
+
+    def write_history(number):
+        CRUD.write_request_to_history(
+            created_at=f'2026-01-01 00:00:{number:06d}',
+            user=number % 20,
+            command='/low',
+            city='Москва',
+            start_date=datetime.date(2026, 1, 1),
+            end_date=datetime.date(2026, 1, 3),
+            hotels_count=hotels_count,
+            hotels=hotels
+        )
+
+    operations = (
+        ('write_request_to_history', write_history),
+        ('save_hotels_details',
+         lambda number: CRUD.save_hotels_details(hotels)),
+        ('get_fresh_hotels_details',
+         lambda number: CRUD.get_fresh_hotels_details(hotels_ids, 3600)),
+        ('set_cache_entry',
+         lambda number: CRUD.set_cache_entry(
+             'bench', f'город {number % 50}', [['Город', '1']], time.time())),
+        ('get_cache_entry',
+         lambda number: CRUD.get_cache_entry('bench', f'город {number % 50}')),
+        ('get_user_requests',
+         lambda number: list(CRUD.get_user_requests(number % 20)[1])),
+    )
+    for name, operation in operations:
+        started_at = time.perf_counter()
+        for number in range(iterations):
+            operation(number)
+        elapsed = time.perf_counter() - started_at
+        print(f'    {name:>26}: {iterations / elapsed:8.0f} вызовов/с')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--hotels', type=int, default=15)
+    parser.add_argument('--child', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_profile(args.iterations, args.hotels)
+        return
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for profile in config.DATABASE_PROFILES:
+        print(f'Профиль {profile}:', flush=True)
+        subprocess.run(
+            [sys.executable, '-m', 'benchmarks.database_profiles', '--child',
+             '--iterations', str(args.iterations),
+             '--hotels', str(args.hotels)],
+            cwd=tempfile.mkdtemp(prefix='hotels_bot_bench_'),
+            env=os.environ | {
+                'DATABASE_PROFILE': profile,
+                'PYTHONPATH': project_root,
+            },
+            check=True
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+'''
+Замер полных диалогов /low, /high и /bestdeals без обращения к сети.
+API сервиса сайта и Telegram Bot API подменяются локальными HTTP
+серверами (benchmarks.fake_servers), бот обращается к ним через
+обычные ApiClient и telebot. Диалоги выполняются параллельно,
+concurrency диалогов одновременно, шаги одного диалога - по порядку.
+
+Выводит пропускную способность, p50/p95/p99 длительности диалога
+и последнего шага (поиск и отправка результатов), количество
+вызовов API и Telegram и объем ответов API на один диалог.
+
+Запуск из корня проекта:
+    python -m benchmarks.dialogs --dialogs 60 --concurrency 10 \\
+        --api-latency 0.2 --api-error-rate 0.02
+'''
+import argparse
+import datetime
+import math
+import os
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+COMMANDS = ('/low', '/high', '/bestdeals')
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    '''Перцентиль методом ближайшего ранга'''
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def city_name(index: int) -> str:
+    '''Уникальное название города кириллицей'''
+    letters = 'абвгдежзиклмнопрстуфхцчшэюя'
+    name = ''
+    while True:
+        index, remainder = divmod(index, len(letters))
+        name += letters[remainder]
+        if not index:
+            break
+    return f'Город {name}'
+
+
+def make_dialog_steps(command: str,
+                      city: str,
+                      hotels_count: int,
+                      images_count: int) -> List[Tuple[str, str]]:
+    '''Шаги диалога: ('text', сообщение) или ('callback', данные кнопки)'''
+    from benchmarks.fake_servers import get_region_id
+
+    enter_date = datetime.date.today() + datetime.timedelta(days=30)
+    end_date = enter_date + datetime.timedelta(days=3)
+    steps = [
+        ('text', command),
+        ('text', city),
+        ('callback', f'city:{get_region_id(city)}:{city}'),
+        ('text', str(hotels_count)),
+        ('callback', f'cbcal_0_s_d_{enter_date:%Y_%m_%d}'),
+        ('callback', f'cbcal_0_s_d_{end_date:%Y_%m_%d}'),
+    ]
+    if images_count:
+        steps += [('text', 'Да'), ('text', str(images_count))]
+    else:
+        steps.append(('text', 'Нет'))
+    if command == '/bestdeals':
+        steps += [('text', '5'), ('text', '50'), ('text', '300')]
+    return steps
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dialogs', type=int, default=60)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--commands', default=','.join(COMMANDS),
+                        help='команды через запятую')
+    parser.add_argument('--cities', type=int, default=0,
+                        help='число разных городов, 0 - у каждого свой')
+    parser.add_argument('--hotels', type=int, default=5)
+    parser.add_argument('--images', type=int, default=3)
+    parser.add_argument('--api-latency', type=float, default=0.2)
+    parser.add_argument('--api-jitter', type=float, default=0.05)
+    parser.add_argument('--api-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='соблюдать лимиты частоты Telegram')
+    args = parser.parse_args()
+    commands = [command.strip() for command in args.commands.split(',')]
+
+    os.chdir(tempfile.mkdtemp(prefix='hotels_bot_bench_'))
+
+    from loguru import logger
+    from telebot import apihelper
+    from telebot.types import Update
+
+    import handlers  # noqa: F401
+    from api import http_client
+    from benchmarks.fake_servers import (FakeHotelsApiServer,
+                                         FakeTelegramServer)
+    from benchmarks.fakes import make_callback_update, make_message_update
+    from database.tools.history_writer import history_writer
+    from loader import bot, sender
+    from main import setup_bot
+    from utils.misc.rate_limiter import SendScheduler
+
+    logger.remove()
+    api_server = FakeHotelsApiServer(
+        latency=args.api_latency,
+        jitter=args.api_jitter,
+        error_rate=args.api_error_rate
+    ).start()
+    telegram_server = FakeTelegramServer(
+        latency=args.telegram_latency).start()
+    apihelper.API_URL = telegram_server.api_url
+    http_client.set_client(http_client.ApiClient(
+        api_server.url, backoff_factor=0.05))
+    if not args.telegram_limits:
+        sender.scheduler = SendScheduler(
+            global_rate=10 ** 6, global_burst=10 ** 6,
+            chat_rate=10 ** 6, chat_burst=10 ** 6)
+    setup_bot(is_commands_needed=False)
+    bot.threaded = False
+
+    def run_dialog(number: int) -> Tuple[str, float, float]:
+        user_id = 100000 + number
+        command = commands[number % len(commands)]
+        cities_count = args.cities or args.dialogs
+        steps = make_dialog_steps(
+            command, city_name(number % cities_count),
+            args.hotels, args.images)
+        started_at = time.perf_counter()
+        last_step_duration = 0.0
+        for step_number, (kind, value) in enumerate(steps):
+            update_id = number * 100 + step_number
+            if kind == 'text':
+                update = make_message_update(update_id, user_id, value)
+            else:
+                update = make_callback_update(update_id, user_id, value)
+            step_started_at = time.perf_counter()
+            bot.process_new_updates([Update.de_json(update)])
+            last_step_duration = time.perf_counter() - step_started_at
+        return (command, time.perf_counter() - started_at,
+                last_step_duration)
+
+    print(f'Диалогов: {args.dialogs}, одновременно: {args.concurrency}, '
+          f'задержка API: {args.api_latency}с, '
+          f'ошибки API: {args.api_error_rate:.0%}, '
+          f'задержка Telegram: {args.telegram_latency}с, '
+          f'лимиты Telegram: {"да" if args.telegram_limits else "нет"}')
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(run_dialog, range(args.dialogs)))
+    elapsed = time.perf_counter() - started_at
+    history_writer.stop()
+
+    durations: Dict[str, List[float]] = defaultdict(list)
+    last_steps: Dict[str, List[float]] = defaultdict(list)
+    for command, duration, last_step_duration in results:
+        durations[command].append(duration)
+        last_steps[command].append(last_step_duration)
+        durations['все'].append(duration)
+        last_steps['все'].append(last_step_duration)
+    print(f'Время: {elapsed:.2f}с, '
+          f'{args.dialogs / elapsed:.2f} диалогов/с')
+    for command in commands + ['все']:
+        values, last_values = durations[command], last_steps[command]
+        print(f'{command:>10}: диалогов {len(values)}, '
+              'длительность p50/p95/p99 '
+              f'{percentile(values, 50):.3f}/{percentile(values, 95):.3f}/'
+              f'{percentile(values, 99):.3f}с, '
+              'последний шаг '
+              f'{percentile(last_values, 50):.3f}/'
+              f'{percentile(last_values, 95):.3f}/'
+              f'{percentile(last_values, 99):.3f}с')
+    print('Вызовов API на диалог: ' + ', '.join(
+        f'{endpoint} {count / args.dialogs:.2f}'
+        for endpoint, count in sorted(api_server.calls.items())))
+    print('Ответов API на диалог, КБ: ' + ', '.join(
+        f'{endpoint} {size / 1024 / args.dialogs:.1f}'
+        for endpoint, size in sorted(api_server.payload_bytes.items())))
+    if api_server.errors:
+        print('Внедрено ошибок API: ' + ', '.join(
+            f'{status}: {count}'
+            for status, count in sorted(api_server.errors.items())))
+    print('Вызовов Telegram на диалог: ' + ', '.join(
+        f'{method} {count / args.dialogs:.2f}'
+        for method, count in sorted(telegram_server.calls.items())))
+    api_server.stop()
+    telegram_server.stop()
+
+
+if __name__ == '__main__':
+    main()
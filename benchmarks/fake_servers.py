@@ -0,0 +1,257 @@
+'''
+Локальные заглушки внешних сервисов для замеров без сети:
+FakeHotelsApiServer - API сервиса сайта (RapidAPI hotels4), отвечает
+записанными ответами из каталога recordings с задержкой и
+внедрением ошибок, FakeTelegramServer - Telegram Bot API.
+'''
+import copy
+import json
+import os
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from benchmarks.fakes import FakeTelegram
+
+RECORDINGS_DIR = os.path.join(os.path.dirname(__file__), 'recordings')
+
+
+def load_recording(name: str) -> Dict:
+    with open(os.path.join(RECORDINGS_DIR, f'{name}.json'),
+              encoding='utf-8') as recording:
+        return json.load(recording)
+
+
+def get_region_id(city_name: str) -> str:
+    '''Стабильный id региона для названия города'''
+    return str(zlib.crc32(city_name.casefold().encode('utf-8')) % 100000)
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _BackgroundServer:
+    '''HTTP сервер на свободном локальном порту в фоновом потоке'''
+    handler_class = BaseHTTPRequestHandler
+
+    def __init__(self) -> None:
+        handler_class = type(
+            'Handler', (self.handler_class,), {'fake_server': self})
+        self._server = _QuietServer(('127.0.0.1', 0), handler_class)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self) -> '_BackgroundServer':
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class _HotelsApiHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status: int, data: Dict,
+                   headers: Optional[Dict] = None) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, payload: Dict) -> None:
+        url = urlsplit(self.path)
+        endpoint = url.path.strip('/')
+        status, data, headers = self.fake_server.respond(
+            endpoint, dict(parse_qsl(url.query)), payload)
+        self._send_json(status, data, headers)
+
+    def do_GET(self) -> None:
+        self._handle({})
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b'{}'
+        self._handle(json.loads(body or b'{}'))
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class FakeHotelsApiServer(_BackgroundServer):
+    '''
+    Заглушка API сервиса сайта. Отвечает записанными ответами
+    locations/v3/search, properties/v2/list и properties/v2/detail:
+    город и id отелей подставляются из запроса, список отелей
+    сортируется, фильтруется по цене и делится на страницы как в API.
+    Каждый ответ задерживается на latency +- jitter секунд, с
+    вероятностью error_rate вместо ответа возвращается 429/500/503.
+    '''
+    handler_class = _HotelsApiHandler
+    ERROR_STATUSES = (429, 500, 503)
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 jitter: float = 0.0,
+                 error_rate: float = 0.0,
+                 seed: int = 0) -> None:
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self.payload_bytes = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._search = load_recording('locations_v3_search')
+        self._list = load_recording('properties_v2_list')
+        self._detail = load_recording('properties_v2_detail')
+
+    def _get_delay_and_error(self) -> Tuple[float, Optional[int]]:
+        with self._lock:
+            delay = self.latency + self._random.uniform(
+                -self.jitter, self.jitter)
+            error_status = None
+            if self._random.random() < self.error_rate:
+                error_status = self._random.choice(self.ERROR_STATUSES)
+        return max(0.0, delay), error_status
+
+    def respond(self, endpoint: str, params: Dict,
+                payload: Dict) -> Tuple[int, Dict, Dict]:
+        with self._lock:
+            self.calls[endpoint] += 1
+        delay, error_status = self._get_delay_and_error()
+        time.sleep(delay)
+        if error_status is not None:
+            with self._lock:
+                self.errors[error_status] += 1
+            return error_status, {'message': 'Injected error'}, (
+                {'Retry-After': '0'} if error_status == 429 else {})
+        if endpoint == 'locations/v3/search':
+            data = self._make_search(params.get('q', ''))
+        elif endpoint == 'properties/v2/list':
+            data = self._make_list(payload)
+        elif endpoint == 'properties/v2/detail':
+            data = self._make_detail(str(payload.get('propertyId', '')))
+        else:
+            return 404, {'message': f'Unknown endpoint {endpoint}'}, {}
+        with self._lock:
+            self.payload_bytes[endpoint] += len(
+                json.dumps(data, ensure_ascii=False).encode('utf-8'))
+        return 200, data, {}
+
+    def _make_search(self, city_name: str) -> Dict:
+        data = copy.deepcopy(self._search)
+        data['q'] = city_name
+        city = data['sr'][0]
+        city['gaiaId'] = get_region_id(city_name)
+        city['regionNames']['shortName'] = city_name
+        city['regionNames']['fullName'] = f'{city_name}, Россия'
+        return data
+
+    def _make_list(self, payload: Dict) -> Dict:
+        region_id = payload.get('destination', {}).get('regionId', '0')
+        properties = []
+        for item in self._list['data']['propertySearch']['properties']:
+            item = copy.copy(item)
+            item['id'] = f'{region_id}{item["id"]}'
+            properties.append(item)
+        price_filter = payload.get('filters', {}).get('price') or {}
+        if price_filter.get('min') is not None:
+            properties = [
+                item for item in properties
+                if item['price']['lead']['amount'] >= price_filter['min']]
+        if price_filter.get('max') is not None:
+            properties = [
+                item for item in properties
+                if item['price']['lead']['amount'] <= price_filter['max']]
+        if payload.get('sort') == 'PRICE_LOW_TO_HIGH':
+            properties.sort(key=lambda item: item['price']['lead']['amount'])
+        elif payload.get('sort') == 'DISTANCE':
+            properties.sort(key=lambda item: (
+                item['destinationInfo']['distanceFromDestination']['value']))
+        start = int(payload.get('resultsStartingIndex', 0))
+        size = int(payload.get('resultsSize', 200))
+        return {'data': {'propertySearch': {
+            '__typename': 'PropertySearchResults',
+            'properties': properties[start:start + size],
+            'summary': {'matchedPropertiesSize': len(properties)},
+        }}}
+
+    def _make_detail(self, property_id: str) -> Dict:
+        data = copy.deepcopy(self._detail)
+        summary = data['data']['propertyInfo']['summary']
+        summary['id'] = property_id
+        summary['location']['address']['addressLine'] = (
+            f'Тверская улица, {property_id[-3:]}, Москва')
+        for item in data['data']['propertyInfo']['propertyGallery']['images']:
+            item['image']['url'] = item['image']['url'].replace(
+                '/1000/', f'/{property_id}/')
+        return data
+
+
+class _TelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self, body: bytes) -> None:
+        url = urlsplit(self.path)
+        api_method = url.path.rsplit('/', 1)[-1]
+        params = dict(parse_qsl(url.query))
+        if body and self.headers.get('Content-Type', '').startswith(
+                'application/x-www-form-urlencoded'):
+            params.update(parse_qsl(body.decode('utf-8')))
+        result = self.fake_server.telegram.make_result(api_method, params)
+        data = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        self._handle(b'')
+
+    def do_POST(self) -> None:
+        length = int(self.headers.get('Content-Length', 0))
+        self._handle(self.rfile.read(length) if length else b'')
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class FakeTelegramServer(_BackgroundServer):
+    '''
+    Заглушка Telegram Bot API по HTTP. Для работы бота с ней
+    apihelper.API_URL указывается на api_url.
+    '''
+    handler_class = _TelegramHandler
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.telegram = FakeTelegram(latency=latency)
+
+    @property
+    def calls(self) -> Counter:
+        return self.telegram.calls
+
+    @property
+    def api_url(self) -> str:
+        return f'{self.url}/bot{{0}}/{{1}}'
@@ -0,0 +1,150 @@
+import json
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from telebot import apihelper
+
+
+class FakeTelegramResponse:
+    '''Ответ Telegram Bot API в формате, ожидаемом telebot.apihelper'''
+
+    def __init__(self, result) -> None:
+        self.status_code = 200
+        self.reason = 'OK'
+        self.text = json.dumps({'ok': True, 'result': result})
+
+    def json(self) -> Dict:
+        return json.loads(self.text)
+
+
+class FakeTelegram:
+    '''
+    Подмена Telegram Bot API для замеров без сети.
+    Устанавливается как apihelper.CUSTOM_REQUEST_SENDER и
+    считает вызовы методов API.
+    '''
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+        self._message_id = 0
+
+    def make_result(self, api_method: str, params: Optional[Dict]) -> Any:
+        '''Результат метода Bot API в формате ответа Telegram'''
+        with self._lock:
+            self.calls[api_method] += 1
+            self._message_id += 1
+            message_id = self._message_id
+        if self.latency:
+            time.sleep(self.latency)
+        chat_id = int((params or {}).get('chat_id', 0) or 0)
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+        }
+        if api_method == 'sendMediaGroup':
+            return [message]
+        return message
+
+    def __call__(self, method, request_url, params=None, files=None,
+                 timeout=None, proxies=None) -> FakeTelegramResponse:
+        api_method = request_url.rsplit('/', 1)[-1]
+        return FakeTelegramResponse(self.make_result(api_method, params))
+
+    def install(self) -> None:
+        apihelper.CUSTOM_REQUEST_SENDER = self
+
+    @staticmethod
+    def uninstall() -> None:
+        apihelper.CUSTOM_REQUEST_SENDER = None
+
+
+class FakeApiClient:
+    '''
+    Подмена клиента API сервиса сайта (см. api.http_client.set_client),
+    отвечающая заранее заданными данными с задержкой latency.
+    '''
+
+    def __init__(self, latency: float = 0.0,
+                 responses: Optional[Dict[str, Dict]] = None) -> None:
+        self.latency = latency
+        self.responses = responses or {}
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def request(self, method: str, endpoint: str, params=None, json=None,
+                headers=None) -> Tuple[bool, Dict]:
+        with self._lock:
+            self.calls[endpoint] += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if endpoint == 'locations/v3/search':
+            city_name = (params or {}).get('q', '')
+            return True, {'sr': [{
+                'type': 'CITY',
+                'regionNames': {'shortName': city_name},
+                'gaiaId': str(abs(hash(city_name)) % 100000),
+            }]}
+        if endpoint in self.responses:
+            return True, self.responses[endpoint]
+        return False, {}
+
+    def get(self, endpoint: str, params=None, headers=None):
+        return self.request('GET', endpoint, params=params, headers=headers)
+
+    def post(self, endpoint: str, json=None, headers=None):
+        return self.request('POST', endpoint, json=json, headers=headers)
+
+    def is_available(self, endpoint: str) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+
+def make_message_update(update_id: int, user_id: int, text: str) -> Dict:
+    '''JSON обновления Telegram с текстовым сообщением пользователя'''
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {
+                'id': user_id,
+                'is_bot': False,
+                'first_name': f'user{user_id}',
+                'username': f'user{user_id}',
+            },
+            'text': text,
+        },
+    }
+
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> Dict:
+    '''JSON обновления Telegram с нажатием кнопки inline клавиатуры'''
+    user = {
+        'id': user_id,
+        'is_bot': False,
+        'first_name': f'user{user_id}',
+        'username': f'user{user_id}',
+    }
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': 'Выберите',
+            },
+            'chat_instance': str(user_id),
+            'data': data,
+        },
+    }
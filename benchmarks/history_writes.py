@@ -0,0 +1,102 @@
+'''
+Замер скорости записи истории поиска в базу: прежняя построчная запись
+(create_and_return_request/hotel/history на каждый отель) против
+CRUD.write_request_to_history одной транзакцией.
+База создается во временном каталоге.
+
+Запуск из корня проекта:
+    python -m benchmarks.history_writes --requests 200 --hotels 15
+'''
+import argparse
+import datetime
+import os
+import tempfile
+import time
+
+
+def make_hotels(request_number: int, hotels_count: int):
+    from utils.misc.records import HotelResult
+
+    return [
+        HotelResult(
+            id=str(request_number * 7 % 500 + number),
+            name=f'Отель {number}',
+            price=100 + number,
+            distance=number / 10,
+            address=f'Улица {number}, дом {request_number}'
+        )
+        for number in range(hotels_count)
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--hotels', type=int, default=15)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='hotels_bot_bench_'))
+
+    from loguru import logger
+
+    from database.models import History, Hotel, Request, db
+    from database.tools import CRUD
+
+    logger.remove()
+
+    def write_row_by_row(created_at, user, hotels):
+        with db:
+            _, request = CRUD.create_and_return_request(
+                created_at=created_at,
+                user=user,
+                command='/low',
+                city='Москва',
+                start_date=datetime.date(2026, 1, 1),
+                end_date=datetime.date(2026, 1, 3),
+                hotels_count=len(hotels)
+            )
+            for hotel in hotels:
+                _, hotel_created = CRUD.create_and_return_hotel(
+                    id=int(hotel.id),
+                    name=hotel.name,
+                    address=hotel.address,
+                    distance=hotel.distance
+                )
+                CRUD.create_and_return_history(
+                    request=request,
+                    hotel=hotel_created,
+                    hotel_price=hotel.price
+                )
+
+    def write_bulk(created_at, user, hotels):
+        CRUD.write_request_to_history(
+            created_at=created_at,
+            user=user,
+            command='/low',
+            city='Москва',
+            start_date=datetime.date(2026, 1, 1),
+            end_date=datetime.date(2026, 1, 3),
+            hotels_count=len(hotels),
+            hotels=hotels
+        )
+
+    print(f'Запросов: {args.requests}, отелей в запросе: {args.hotels}')
+    for mode, writer in (('row-by-row', write_row_by_row),
+                         ('bulk', write_bulk)):
+        with db:
+            for model in (History, Request, Hotel):
+                model.delete().execute()
+        started_at = time.perf_counter()
+        for number in range(args.requests):
+            writer(f'2026-01-01 00:00:{number:06d}', number % 50,
+                   make_hotels(number, args.hotels))
+        elapsed = time.perf_counter() - started_at
+        with db:
+            history_rows = History.select().count()
+        print(f'{mode:>10}: {elapsed:.2f}с, '
+              f'{args.requests / elapsed:.1f} запросов/с, '
+              f'{history_rows / elapsed:.0f} строк истории/с')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+'''
+Замер разбора ответов API на одну выдачу поиска: ответ
+properties/v2/list и ответы properties/v2/detail по отелям выдачи
+из каталога recordings. Сравнивается прежний разбор (response.json()
+и обход вложенных словарей) с api.parsers на модуле json и orjson,
+если он установлен. Выводит время разбора и пиковую память
+(tracemalloc) на одну выдачу.
+
+Запуск из корня проекта:
+    python -m benchmarks.response_parsing --hotels 200 --details 5
+'''
+import argparse
+import json
+import statistics
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+from api import parsers
+from benchmarks.fake_servers import load_recording
+
+
+def make_payloads(hotels_count: int,
+                  details_count: int) -> Tuple[bytes, List[bytes]]:
+    '''Тела ответов list и detail в байтах, как они приходят по сети'''
+    list_data = load_recording('properties_v2_list')
+    properties = list_data['data']['propertySearch']['properties']
+    list_data['data']['propertySearch']['properties'] = [
+        properties[number % len(properties)]
+        for number in range(hotels_count)]
+    detail_data = load_recording('properties_v2_detail')
+    list_content = json.dumps(list_data, ensure_ascii=False).encode('utf-8')
+    detail_content = json.dumps(detail_data).encode('utf-8')
+    return list_content, [detail_content] * details_count
+
+
+def parse_like_before(list_content: bytes, details_contents: List[bytes],
+                      images_limit: int) -> Tuple[List, List]:
+    '''Разбор как до api.parsers: requests декодирует текст ответа'''
+    hotels = []
+    data = json.loads(list_content.decode('utf-8'))
+    for hotel_item in data['data']['propertySearch']['properties']:
+        hotels.append((
+            hotel_item['id'],
+            hotel_item['name'],
+            round(hotel_item['price']['lead']['amount'], 2),
+            hotel_item['destinationInfo']['distanceFromDestination']['value']
+        ))
+    details = []
+    for content in details_contents:
+        data = json.loads(content.decode('utf-8'))
+        address = (data['data']['propertyInfo']['summary']['location']
+                   ['address']['addressLine'])
+        images_links = []
+        for item in (data['data']['propertyInfo']['propertyGallery']
+                     ['images'][:images_limit]):
+            images_links.append(item['image']['url'])
+        details.append((address, images_links))
+    return hotels, details
+
+
+def parse_with_parsers(list_content: bytes, details_contents: List[bytes],
+                       images_limit: int) -> Tuple[List, List]:
+    hotels = parsers.parse_hotels_list(parsers.loads(list_content))
+    details = [
+        parsers.parse_hotel_detail(parsers.loads(content), images_limit)
+        for content in details_contents]
+    return hotels, details
+
+
+def measure(parse: Callable, repeats: int, *args) -> Tuple[float, int]:
+    '''Медиана времени разбора в секундах и пиковая память в байтах'''
+    durations = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        parse(*args)
+        durations.append(time.perf_counter() - started_at)
+    tracemalloc.start()
+    parse(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(durations), peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--hotels', type=int, default=200)
+    parser.add_argument('--details', type=int, default=5)
+    parser.add_argument('--images', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    list_content, details_contents = make_payloads(args.hotels, args.details)
+    print(f'Отелей в списке: {args.hotels}, '
+          f'ответ list {len(list_content) / 1024:.1f} КБ, '
+          f'ответов detail: {args.details}')
+    variants = [('прежний разбор', parse_like_before, None)]
+    variants.append(('parsers + json', parse_with_parsers, None))
+    if parsers.orjson is not None:
+        variants.append(
+            ('parsers + orjson', parse_with_parsers, parsers.orjson))
+    else:
+        print('orjson не установлен, замер только с модулем json')
+    for name, parse, decoder in variants:
+        previous_decoder, parsers.orjson = parsers.orjson, decoder
+        try:
+            duration, peak = measure(
+                parse, args.repeats, list_content, details_contents,
+                args.images)
+        finally:
+            parsers.orjson = previous_decoder
+        print(f'{name:>17}: {duration * 1000:.2f} мс, '
+              f'пик памяти {peak / 1024:.0f} КБ на выдачу')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+'''
+Замер пропускной способности обработки обновлений при N одновременных
+пользователях: режим polling, как в исходном боте (TeleBot с пулом
+потоков по умолчанию, num_threads=2), против асинхронного режима
+(BOT_RUNTIME=async). Каждый пользователь отправляет /low, а после
+обработки всех команд - название города, как пользователь, который
+отвечает на подсказку бота. Сеть не используется: Telegram Bot API и
+API сервиса сайта подменяются заглушками с заданной задержкой.
+
+Запуск из корня проекта:
+    python -m benchmarks.runtime_load --users 50 --api-latency 0.3
+'''
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+
+def city_name(index: int) -> str:
+    '''Уникальное название города кириллицей для пользователя'''
+    letters = 'абвгдежзиклмнопрстуфхцчшэюя'
+    name = ''
+    while True:
+        index, remainder = divmod(index, len(letters))
+        name += letters[remainder]
+        if not index:
+            break
+    return f'Город {name}'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--api-latency', type=float, default=0.3)
+    parser.add_argument('--telegram-latency', type=float, default=0.02)
+    parser.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+
+    os.chdir(tempfile.mkdtemp(prefix='hotels_bot_bench_'))
+
+    from loguru import logger
+    from telebot.types import Update
+
+    import handlers  # noqa: F401
+    from api import hotels_service, http_client
+    from benchmarks.fakes import (FakeApiClient, FakeTelegram,
+                                  make_message_update)
+    from loader import bot
+    from main import setup_bot
+    from utils.runtime import AsyncUpdateDispatcher
+
+    logger.remove()
+    telegram = FakeTelegram(latency=args.telegram_latency)
+    telegram.install()
+    api_client = FakeApiClient(latency=args.api_latency)
+    http_client.set_client(api_client)
+    hotels_service.cities_cache.storage = None
+    setup_bot()
+
+    def make_updates():
+        '''Обновления по этапам: команды, затем названия городов'''
+        phases = []
+        for phase_number, get_text in enumerate(
+                (lambda user_id: '/low', city_name)):
+            phases.append([
+                Update.de_json(make_message_update(
+                    phase_number * args.users + user_id, user_id,
+                    get_text(user_id)))
+                for user_id in range(1, args.users + 1)])
+        return phases
+
+    def run_threaded(phases):
+        '''
+        Обработка пулом потоков TeleBot, как в infinity_polling.
+        Этап завершен, когда каждый поток пула дошел до барьера,
+        поставленного в очередь после обновлений этапа.
+        '''
+        bot.threaded = True
+        workers_count = bot.worker_pool.num_threads
+        for updates in phases:
+            bot.process_new_updates(updates)
+            barrier = threading.Barrier(workers_count + 1)
+            for _ in range(workers_count):
+                bot.worker_pool.put(barrier.wait)
+            barrier.wait()
+        bot.threaded = False
+
+    def run_async(phases):
+        dispatcher = AsyncUpdateDispatcher(bot, args.concurrency)
+
+        async def process():
+            for updates in phases:
+                for update in updates:
+                    dispatcher.dispatch(update)
+                await dispatcher.join()
+
+        asyncio.run(process())
+
+    print(f'Пользователей: {args.users}, '
+          f'задержка API: {args.api_latency}с, '
+          f'задержка Telegram: {args.telegram_latency}с')
+    for mode, runner in (('threaded', run_threaded),
+                         ('async', run_async)):
+        hotels_service.cities_cache.clear()
+        api_client.calls.clear()
+        telegram.calls.clear()
+        phases = make_updates()
+        updates_count = sum(len(updates) for updates in phases)
+        started_at = time.perf_counter()
+        runner(phases)
+        elapsed = time.perf_counter() - started_at
+        print(f'{mode:>10}: {elapsed:.2f}с, '
+              f'{updates_count / elapsed:.1f} обновлений/с, '
+              f'{args.users / elapsed:.1f} пользователей/с, '
+              f'вызовов API: {sum(api_client.calls.values())}, '
+              f'вызовов Telegram: {sum(telegram.calls.values())}')
+    telegram.uninstall()
+
+
+if __name__ == '__main__':
+    main()
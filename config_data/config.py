@@ -10,11 +10,110 @@ else:
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 RAPID_API_KEY = os.getenv('RAPID_API_KEY')
 RAPID_API_HOST = os.getenv('RAPID_API_HOST')
+BOT_RUNTIME = os.getenv('BOT_RUNTIME') or 'polling'
+WEBHOOK_URL = os.getenv('WEBHOOK_URL') or None
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or None
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST') or '0.0.0.0'
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT') or 8443)
+BOT_SHARDS = int(os.getenv('BOT_SHARDS') or 1)
+METRICS_HOST = os.getenv('METRICS_HOST') or '127.0.0.1'
+METRICS_PORT = int(os.getenv('METRICS_PORT') or 0)
+METRICS_ENABLED = METRICS_PORT > 0
+TRACE_FILE = os.getenv('TRACE_FILE') or None
+if BOT_RUNTIME not in ('polling', 'async', 'webhook'):
+    exit(f'Неизвестный режим запуска BOT_RUNTIME={BOT_RUNTIME}, '
+         'допустимы polling, async и webhook')
 
 BOT_DATABASE_NAME = 'bot.db'
+DATABASE_PROFILE = os.getenv('DATABASE_PROFILE') or 'tuned'
+STATE_STORAGE = os.getenv('STATE_STORAGE') or 'sqlite'
+if STATE_STORAGE not in ('sqlite', 'memory'):
+    exit(f'Неизвестное хранилище STATE_STORAGE={STATE_STORAGE}, '
+         'допустимы sqlite и memory')
+DATABASE_PROFILES = {
+    'default': {
+        'pooled': False,
+        'pragmas': {},
+    },
+    'tuned': {
+        'pooled': True,
+        'pragmas': {
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'cache_size': -64 * 1024,
+            'mmap_size': 256 * 1024 * 1024,
+            'busy_timeout': 5000,
+        },
+    },
+}
+DATABASE_MAX_CONNECTIONS = 64
+DATABASE_STALE_TIMEOUT = 300
 REQUESTS_TIMEOUT = 30
+HTTP_MAX_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+HTTP_BACKOFF_MAX = 10
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_WINDOW_SIZE = 10
+CIRCUIT_RECOVERY_TIMEOUT = 30
+API_MAX_CONCURRENCY = 10
+# Сведения об отелях каждый диалог запрашивает в
+# HOTEL_DETAILS_MAX_WORKERS потоков, лимит рассчитан на
+# WEBHOOK_WORKERS одновременных диалогов
+API_ENDPOINT_MAX_CONCURRENCY = {'properties/v2/detail': 40}
+# Соединений хватает на лимиты всех трех точек API: search и list
+# по API_MAX_CONCURRENCY, detail по API_ENDPOINT_MAX_CONCURRENCY
+HTTP_POOL_SIZE = (2 * API_MAX_CONCURRENCY
+                  + sum(API_ENDPOINT_MAX_CONCURRENCY.values()))
+API_MIN_CONCURRENCY = 1
+API_LATENCY_THRESHOLD = 5
+API_QUEUE_TIMEOUT = 2
 HOTEL_PHOTOS_LIMIT = 10
 HOTEL_REQUESTS_LIMIT = 15
+HOTEL_DETAILS_MAX_WORKERS = 5
+HOTEL_LIST_PAGE_SIZE = 50
+HOTEL_LIST_MAX_PAGE_SIZE = 200
+HOTEL_LIST_MAX_RESULTS = 1000
+HOTEL_LIST_ESTIMATE_MARGIN = 1.2
+RESULTS_EDIT_INTERVAL = 1
+MEDIA_GROUP_LIMIT = 10
+TELEGRAM_MESSAGE_LIMIT = 4096
+# Название и адрес отеля обрезаются, чтобы строка сводки и подпись к
+# фотографиям (до 1024 символов) укладывались в лимиты Telegram
+HOTEL_NAME_MAX_LENGTH = 150
+HOTEL_ADDRESS_MAX_LENGTH = 250
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_GLOBAL_BURST = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_MAX_RETRIES = 3
+ASYNC_HANDLERS_CONCURRENCY = 32
+WEBHOOK_WORKERS = 8
+WEBHOOK_QUEUE_SIZE = 1000
+WEBHOOK_QUEUE_TIMEOUT = 5
+SHARD_QUEUE_SIZE = 1000
+SHARD_CHECK_INTERVAL = 5
+
+CITIES_CACHE_SIZE = 1000
+CITIES_CACHE_TTL = 7 * 24 * 60 * 60
+CITIES_CACHE_PERSISTENT = True
+HOTEL_DETAILS_CACHE_TTL = 24 * 60 * 60
+SEARCH_CACHE_SIZE = 200
+SEARCH_CACHE_TTL = 5 * 60
+# Сколько еще после TTL ответ можно отдать, пока API недоступен
+SEARCH_CACHE_STALE_TTL = 6 * 60 * 60
+HOTEL_DETAILS_STALE_TTL = 30 * 24 * 60 * 60
+HOTEL_INDEX_SIZE = 200
+
+HISTORY_WRITER_BATCH_SIZE = 50
+HISTORY_WRITER_FLUSH_INTERVAL = 1
+HISTORY_RETENTION_DAYS = 180
+HISTORY_MAX_REQUESTS_PER_USER = 50
+HISTORY_ARCHIVE_DIR = 'archive'
+MAINTENANCE_INTERVAL = 6 * 60 * 60
+MAINTENANCE_VACUUM_PAGES = 1000
+STATE_TTL = 24 * 60 * 60
+STATE_FLUSH_INTERVAL = 1
+TRACE_FLUSH_INTERVAL = 1
 
 DEFAULT_COMMANDS = (
     ('start', "Запустить бота"),
@@ -1,8 +1,29 @@
 import peewee as pw
+from playhouse.migrate import SqliteMigrator, migrate
+from playhouse.pool import PooledSqliteDatabase
 
 from config_data import config
 
-db = pw.SqliteDatabase(config.BOT_DATABASE_NAME)
+
+def create_database() -> pw.SqliteDatabase:
+    '''
+    Создание базы согласно профилю настроек DATABASE_PROFILE:
+    набор PRAGMA и использование пула постоянных соединений.
+    '''
+    profile = config.DATABASE_PROFILES[config.DATABASE_PROFILE]
+    if profile['pooled']:
+        return PooledSqliteDatabase(
+            config.BOT_DATABASE_NAME,
+            pragmas=profile['pragmas'],
+            max_connections=config.DATABASE_MAX_CONNECTIONS,
+            stale_timeout=config.DATABASE_STALE_TIMEOUT,
+            check_same_thread=False
+        )
+    return pw.SqliteDatabase(
+        config.BOT_DATABASE_NAME, pragmas=profile['pragmas'])
+
+
+db = create_database()
 
 
 class BaseModel(pw.Model):
@@ -17,6 +38,8 @@ class Hotel(BaseModel):
     name = pw.CharField(max_length=50, null=False)
     address = pw.CharField(max_length=150, null=False)
     distance = pw.FloatField(null=False)
+    images = pw.TextField(null=True)
+    details_updated_at = pw.DateTimeField(null=True)
 
     class Meta:
         order_by = 'id'
@@ -25,7 +48,7 @@ class Hotel(BaseModel):
 class Request(BaseModel):
     '''Модель класса для хранения запроса пользователя в базе.'''
     created_at = pw.DateTimeField(null=False)
-    user = pw.CharField(max_length=30, null=False)
+    user = pw.CharField(max_length=30, null=False, index=True)
     command = pw.CharField(max_length=20, null=False)
     city = pw.CharField(max_length=20, null=False)
     start_date = pw.DateField(null=False)
@@ -56,6 +79,51 @@ class History(BaseModel):
         )
 
 
+class CacheEntry(BaseModel):
+    '''Модель класса для хранения записей кэша ответов API в базе.'''
+    namespace = pw.CharField(max_length=30, null=False)
+    key = pw.CharField(max_length=255, null=False)
+    value = pw.TextField(null=False)
+    stored_at = pw.FloatField(null=False)
+
+    class Meta:
+        primary_key = pw.CompositeKey('namespace', 'key')
+
+
+class DialogState(BaseModel):
+    '''Модель класса для хранения состояния диалога пользователя в базе.'''
+    chat_id = pw.BigIntegerField(null=False)
+    user_id = pw.BigIntegerField(null=False)
+    state = pw.CharField(max_length=100, null=True)
+    data = pw.TextField(null=False)
+    updated_at = pw.FloatField(null=False, index=True)
+
+    class Meta:
+        primary_key = pw.CompositeKey('chat_id', 'user_id')
+
+
 Hotel.create_table()
 History.create_table()
 Request.create_table()
+CacheEntry.create_table()
+DialogState.create_table()
+
+
+def migrate_hotel_table() -> None:
+    '''Добавление колонок кэша сведений об отеле в существующую таблицу'''
+    table_name = Hotel._meta.table_name
+    columns = {column.name for column in db.get_columns(table_name)}
+    migrator = SqliteMigrator(db)
+    operations = [
+        migrator.add_column(table_name, name, field)
+        for name, field in (
+            ('images', pw.TextField(null=True)),
+            ('details_updated_at', pw.DateTimeField(null=True)),
+        )
+        if name not in columns
+    ]
+    if operations:
+        migrate(*operations)
+
+
+migrate_hotel_table()
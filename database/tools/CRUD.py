@@ -1,9 +1,15 @@
-from typing import Any
+import datetime
+import json
+from typing import Any, Dict, List, Optional
 
 import peewee as pw
 from loguru import logger
 
-from database.models import History, Hotel, Request, db
+from database.models import (CacheEntry, DialogState, History, Hotel, Request,
+                             db)
+from utils.misc.metrics import DB_WRITE_DURATION
+from utils.misc.records import HotelResult
+from utils.misc.tracing import tracer
 
 
 @logger.catch
@@ -63,21 +69,117 @@ def create_and_return_request(created_at,
         if high_price is not None:
             request.high_price = high_price
         request.save()
-        return True, Request.select().where(
+        return True, request
+    except pw.IntegrityError:
+        logger.debug(
+            (f'Запрос с датой {created_at} и пользователем '
+             f'{user} уже находится в базе!'))
+        return True, Request.get(
             Request.created_at == created_at,
             Request.user == user
         )
-    except pw.IntegrityError:
+    except Exception as error:
+        logger.exception(f'Ошибка при работе с базой: {error}')
+        return False, None
+
+
+def _write_request(created_at,
+                   user,
+                   command,
+                   city,
+                   start_date,
+                   end_date,
+                   hotels_count,
+                   hotels,
+                   is_images_needed=False,
+                   images_count=0,
+                   distance=None,
+                   low_price=None,
+                   high_price=None
+                   ) -> Request:
+    '''
+    Запись запроса и его отелей в уже открытой транзакции.
+    Повторный запрос с той же датой и пользователем не записывается,
+    его отели добавляются к уже записанному.
+    '''
+    request_fields = {
+        'created_at': created_at,
+        'user': user,
+        'command': command,
+        'city': city,
+        'start_date': start_date,
+        'end_date': end_date,
+        'hotels_count': hotels_count,
+        'is_images_needed': is_images_needed,
+        'images_count': images_count,
+        'distance': distance,
+        'low_price': low_price,
+        'high_price': high_price,
+    }
+    cursor = db.execute(
+        Request.insert(**request_fields).on_conflict_ignore())
+    if cursor.rowcount:
+        request = Request(id=cursor.lastrowid, **request_fields)
+    else:
         logger.debug(
             (f'Запрос с датой {created_at} и пользователем '
              f'{user} уже находится в базе!'))
-        return True, Request.select().where(
+        request = Request.get(
             Request.created_at == created_at,
             Request.user == user
         )
+    Hotel.insert_many([
+        {
+            'id': int(hotel.id),
+            'name': hotel.name,
+            'address': hotel.address,
+            'distance': hotel.distance,
+        }
+        for hotel in hotels
+    ]).on_conflict(
+        conflict_target=[Hotel.id],
+        preserve=[Hotel.name, Hotel.address, Hotel.distance]
+    ).execute()
+    History.insert_many([
+        {
+            'request': request.id,
+            'hotel': int(hotel.id),
+            'hotel_price': hotel.price,
+        }
+        for hotel in hotels
+    ]).on_conflict_ignore().execute()
+    logger.debug(
+        f'Запрос {request.id} и {len(hotels)} отелей записаны в базу')
+    return request
+
+
+@logger.catch
+@DB_WRITE_DURATION.timer(operation='write_requests_to_history')
+def write_requests_to_history(
+        requests_data: List[Dict]) -> List[Optional[Request]]:
+    '''
+    Запись нескольких запросов с отелями одной транзакцией.
+    Каждый элемент requests_data - аргументы write_request_to_history.
+    Ошибка записи одного запроса не отменяет запись остальных.
+    Возвращает созданные запросы, None на месте незаписанных.
+    '''
+    results = []
+    try:
+        with db:
+            for request_data in requests_data:
+                if len(request_data['hotels']) < 1:
+                    results.append(None)
+                    continue
+                try:
+                    with db.atomic():
+                        results.append(_write_request(**request_data))
+                except Exception as error:
+                    logger.exception(f'Ошибка при работе с базой: {error}')
+                    results.append(None)
     except Exception as error:
         logger.exception(f'Ошибка при работе с базой: {error}')
-        return False, None
+        return [None] * len(requests_data)
+    return results
 
 
 @logger.catch
@@ -94,48 +196,27 @@ def write_request_to_history(created_at,
                              distance=None,
                              low_price=None,
                              high_price=None
-                             ) -> bool:
-    '''Запись всех данных(запрос и отели) в базу данных'''
-    with db:
-        if len(hotels) < 1:
-            return False
-        is_completed, request_creaded = create_and_return_request(
-            created_at=created_at,
-            user=user,
-            command=command,
-            city=city,
-            start_date=start_date,
-            end_date=end_date,
-            hotels_count=hotels_count,
-            is_images_needed=is_images_needed,
-            images_count=images_count,
-            distance=distance,
-            low_price=low_price,
-            high_price=high_price
-        )
-        if not is_completed:
-            logger.error(
-                'Не удалось записать и получить данные запроса в базу.')
-            return False
-        for hotel in hotels:
-            is_completed, hotel_creaded = create_and_return_hotel(
-                id=hotel['id'],
-                name=hotel['name'],
-                address=hotel['address'],
-                distance=hotel['destination']
-            )
-            if not is_completed:
-                logger.error('Не удалось записать данные отелей в базу.')
-                return False
-            is_completed = create_and_return_history(
-                request=request_creaded,
-                hotel=hotel_creaded,
-                hotel_price=hotel['hotel_price']
-            )
-            if not is_completed:
-                logger.error('Не удалось записать данные истории в базу.')
-                return False
-        return True
+                             ) -> Optional[Request]:
+    '''
+    Запись всех данных(запрос и отели) в базу данных одной транзакцией.
+    hotels - записи HotelResult с адресами.
+    Возвращает созданный запрос или None при ошибке.
+    '''
+    return write_requests_to_history([{
+        'created_at': created_at,
+        'user': user,
+        'command': command,
+        'city': city,
+        'start_date': start_date,
+        'end_date': end_date,
+        'hotels_count': hotels_count,
+        'hotels': hotels,
+        'is_images_needed': is_images_needed,
+        'images_count': images_count,
+        'distance': distance,
+        'low_price': low_price,
+        'high_price': high_price,
+    }])[0]
 
 
 @logger.catch
@@ -176,6 +257,36 @@ def get_user_requests(user: int) -> tuple[bool, Any]:
         return False, None
 
 
+@logger.catch
+def get_user_requests_page(
+        user: int,
+        page: int = 1) -> tuple[bool, int, int, Optional[Request]]:
+    '''
+    Получение одной страницы истории запросов пользователя.
+    Возвращает признак успеха, общее количество запросов, номер
+    страницы и запрос с уже загруженными отелями. Номер страницы
+    вне диапазона заменяется на последнюю страницу.
+    '''
+    try:
+        with db:
+            user_requests = Request.select().where(Request.user == user)
+            total = user_requests.count()
+            if total == 0:
+                return True, 0, 0, None
+            if page < 1 or page > total:
+                page = total
+            page_query = (user_requests
+                          .order_by(Request.id)
+                          .limit(1)
+                          .offset(page - 1))
+            request, = pw.prefetch(
+                page_query, History.select(), Hotel.select())
+            return True, total, page, request
+    except Exception as error:
+        logger.exception(f'Ошибка при работе с базой: {error}')
+        return False, 0, 0, None
+
+
 @logger.catch
 def delete_user_request(request_id: int) -> bool:
     '''Удаление запроса пользователя по id'''
@@ -193,3 +304,231 @@ def delete_user_request(request_id: int) -> bool:
                  f'удаление данных запроса с id {id}'))
             transaction.rollback()
             return False
+
+
+@logger.catch
+def get_cache_entry(namespace: str, key: str) -> Optional[tuple[Any, float]]:
+    '''Получение записи кэша и времени ее сохранения'''
+    try:
+        with db:
+            entry = CacheEntry.get(
+                CacheEntry.namespace == namespace,
+                CacheEntry.key == key)
+            return json.loads(entry.value), entry.stored_at
+    except CacheEntry.DoesNotExist:
+        return None
+
+
+@logger.catch
+@DB_WRITE_DURATION.timer(operation='set_cache_entry')
+@tracer.span('db set_cache_entry')
+def set_cache_entry(namespace: str,
+                    key: str,
+                    value: Any,
+                    stored_at: float) -> bool:
+    '''Сохранение или обновление записи кэша'''
+    try:
+        with db:
+            CacheEntry.replace(
+                namespace=namespace,
+                key=key,
+                value=json.dumps(value, ensure_ascii=False),
+                stored_at=stored_at
+            ).execute()
+            return True
+    except Exception as error:
+        logger.exception(f'Ошибка при работе с базой: {error}')
+        return False
+
+
+@logger.catch
+def get_fresh_hotels_details(
+        hotels_ids: List[str],
+        max_age: float) -> Dict[str, tuple[str, List[str]]]:
+    '''
+    Получение сохраненных адресов и ссылок на фотографии отелей,
+    обновленных не раньше чем max_age секунд назад.
+    '''
+    updated_after = (datetime.datetime.now()
+                     - datetime.timedelta(seconds=max_age))
+    with db:
+        query = Hotel.select(
+            Hotel.id, Hotel.address, Hotel.images
+        ).where(
+            Hotel.id.in_([int(hotel_id) for hotel_id in hotels_ids]),
+            Hotel.details_updated_at >= updated_after
+        )
+        return {
+            str(hotel.id): (hotel.address, json.loads(hotel.images or '[]'))
+            for hotel in query
+        }
+
+
+@logger.catch
+@DB_WRITE_DURATION.timer(operation='save_hotels_details')
+@tracer.span('db save_hotels_details')
+def save_hotels_details(hotels: List[HotelResult]) -> bool:
+    '''
+    Сохранение или обновление сведений об отелях:
+    адреса, ссылок на фотографии и времени обновления.
+    '''
+    if not hotels:
+        return True
+    updated_at = datetime.datetime.now()
+    rows = [
+        {
+            'id': int(hotel.id),
+            'name': hotel.name,
+            'address': hotel.address,
+            'distance': hotel.distance,
+            'images': json.dumps(hotel.images),
+            'details_updated_at': updated_at,
+        }
+        for hotel in hotels
+    ]
+    try:
+        with db:
+            Hotel.insert_many(rows).on_conflict(
+                conflict_target=[Hotel.id],
+                preserve=[Hotel.address, Hotel.images,
+                          Hotel.details_updated_at]
+            ).execute()
+        return True
+    except Exception as error:
+        logger.exception(f'Ошибка при работе с базой: {error}')
+        return False
+
+
+@logger.catch
+def get_expired_requests_ids(created_before: datetime.datetime,
+                             max_requests_per_user: int) -> List[int]:
+    '''
+    Получение id запросов старше created_before, а также запросов
+    пользователей сверх max_requests_per_user самых новых.
+    '''
+    request_number = pw.fn.ROW_NUMBER().over(
+        partition_by=[Request.user],
+        order_by=[Request.id.desc()]
+    ).alias('request_number')
+    numbered_requests = Request.select(
+        Request.id, Request.created_at, request_number)
+    query = pw.Select(
+        from_list=[numbered_requests.alias('numbered_requests')],
+        columns=[pw.SQL('id')]
+    ).where(
+        (pw.SQL('created_at') < created_before)
+        | (pw.SQL('request_number') > max_requests_per_user)
+    )
+    with db:
+        return [row[0] for row in query.tuples().execute(db)]
+
+
+@logger.catch(reraise=True)
+def get_requests_with_hotels(requests_ids: List[int]) -> List[Dict]:
+    '''
+    Получение запросов вместе с найденными отелями в виде словарей.
+    Ошибка базы пробрасывается: без выгрузки в архив запросы
+    удалять нельзя.
+    '''
+    with db:
+        requests = pw.prefetch(
+            Request.select().where(Request.id.in_(requests_ids)),
+            History.select(),
+            Hotel.select()
+        )
+        return [
+            {
+                'id': request.id,
+                'created_at': request.created_at,
+                'user': request.user,
+                'command': request.command,
+                'city': request.city,
+                'start_date': request.start_date,
+                'end_date': request.end_date,
+                'hotels_count': request.hotels_count,
+                'is_images_needed': request.is_images_needed,
+                'images_count': request.images_count,
+                'distance': request.distance,
+                'low_price': request.low_price,
+                'high_price': request.high_price,
+                'hotels': [
+                    {
+                        'id': item.hotel.id,
+                        'name': item.hotel.name,
+                        'address': item.hotel.address,
+                        'distance': item.hotel.distance,
+                        'hotel_price': item.hotel_price,
+                    }
+                    for item in request.history_request
+                ],
+            }
+            for request in requests
+        ]
+
+
+@logger.catch
+def delete_requests(requests_ids: List[int]) -> int:
+    '''Удаление запросов и их истории. Возвращает число удаленных запросов'''
+    with db:
+        History.delete().where(History.request.in_(requests_ids)).execute()
+        return Request.delete().where(Request.id.in_(requests_ids)).execute()
+
+
+@logger.catch
+def delete_orphaned_hotels(details_updated_before: datetime.datetime) -> int:
+    '''
+    Удаление отелей, на которые не ссылается история запросов,
+    кроме отелей со свежими сведениями, которые используются как кэш.
+    Возвращает число удаленных отелей.
+    '''
+    with db:
+        return Hotel.delete().where(
+            Hotel.id.not_in(History.select(History.hotel)),
+            (Hotel.details_updated_at.is_null())
+            | (Hotel.details_updated_at < details_updated_before)
+        ).execute()
+
+
+@logger.catch
+def get_dialog_states(
+        updated_after: float) -> List[tuple[int, int, str, str, float]]:
+    '''Получение всех диалогов, обновленных после updated_after'''
+    with db:
+        return list(DialogState.select(
+            DialogState.chat_id,
+            DialogState.user_id,
+            DialogState.state,
+            DialogState.data,
+            DialogState.updated_at
+        ).where(DialogState.updated_at >= updated_after).tuples())
+
+
+@logger.catch
+@DB_WRITE_DURATION.timer(operation='save_dialog_states')
+def save_dialog_states(dialog_states: List[Dict],
+                       deleted_keys: List[tuple[int, int]]) -> bool:
+    '''
+    Сохранение измененных и удаление завершенных диалогов
+    одной транзакцией.
+    '''
+    try:
+        with db:
+            for chat_id, user_id in deleted_keys:
+                DialogState.delete().where(
+                    DialogState.chat_id == chat_id,
+                    DialogState.user_id == user_id
+                ).execute()
+            for batch in pw.chunked(dialog_states, 100):
+                DialogState.replace_many(batch).execute()
+        return True
+    except Exception as error:
+        logger.exception(f'Ошибка при работе с базой: {error}')
+        return False
+
+
+@logger.catch
+def delete_expired_dialog_states(updated_before: float) -> int:
+    '''Удаление брошенных диалогов. Возвращает число удаленных'''
+    with db:
+        return DialogState.delete().where(
+            DialogState.updated_at < updated_before).execute()
@@ -0,0 +1,139 @@
+import atexit
+import queue
+import threading
+import time
+from typing import Any, List, Optional, Tuple
+
+from loguru import logger
+
+from config_data import config
+from database.tools import CRUD
+from utils.misc.records import HotelResult
+from utils.misc.tracing import Span, get_current_span, tracer
+
+REQUEST = 'request'
+HOTELS_DETAILS = 'hotels_details'
+
+
+class HistoryWriter:
+    '''
+    Фоновая запись истории поиска в базу одним потоком.
+    Запросы нескольких пользователей накапливаются и записываются
+    одной транзакцией, когда набирается batch_size запросов или
+    проходит flush_interval секунд с первого запроса в пачке.
+    Сведения об отелях, полученные от API, записываются тем же
+    потоком перед запросами своей пачки.
+    '''
+
+    def __init__(self,
+                 batch_size: int = config.HISTORY_WRITER_BATCH_SIZE,
+                 flush_interval: float = config.HISTORY_WRITER_FLUSH_INTERVAL
+                 ) -> None:
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, **request_data) -> None:
+        '''
+        Постановка запроса с отелями в очередь на запись.
+        Запись попадает в трассировку диалога, из которого вызвана.
+        '''
+        self._start()
+        self._queue.put((REQUEST, request_data, get_current_span()))
+
+    def submit_hotels_details(self, hotels: List[HotelResult]) -> None:
+        '''Постановка сведений об отелях в очередь на запись'''
+        if not hotels:
+            return
+        self._start()
+        self._queue.put((HOTELS_DETAILS, hotels, get_current_span()))
+
+    def _flush_hotels_details(
+            self, batch: List[Tuple[str, Any, Optional[Span]]]) -> None:
+        hotels = [hotel for _, hotels, _ in batch for hotel in hotels]
+        started_at = time.time()
+        duration_started_at = time.perf_counter()
+        is_saved = CRUD.save_hotels_details(hotels)
+        duration = time.perf_counter() - duration_started_at
+        for _, _, parent_span in batch:
+            if parent_span is not None:
+                tracer.record_span(
+                    'db save_hotels_details', parent_span,
+                    started_at, duration, hotels_count=len(hotels))
+        if not is_saved:
+            logger.error(
+                f'Сведения {len(hotels)} отелей не были записаны в базу')
+
+    def _flush(self, batch: List[Tuple[str, Any, Optional[Span]]]) -> None:
+        details_batch = [item for item in batch if item[0] == HOTELS_DETAILS]
+        if details_batch:
+            self._flush_hotels_details(details_batch)
+        batch = [item for item in batch if item[0] == REQUEST]
+        if not batch:
+            return
+        requests_data = [request_data for _, request_data, _ in batch]
+        started_at = time.time()
+        duration_started_at = time.perf_counter()
+        results = (CRUD.write_requests_to_history(requests_data)
+                   or [None] * len(batch))
+        duration = time.perf_counter() - duration_started_at
+        for _, _, parent_span in batch:
+            if parent_span is not None:
+                tracer.record_span(
+                    'db write_requests_to_history', parent_span,
+                    started_at, duration, batch_size=len(batch))
+        for request_data, request in zip(requests_data, results):
+            if request is None:
+                logger.error(
+                    ('Данные поискового запроса пользователя '
+                     f'{request_data["user"]} не были записаны в базу'))
+        logger.debug(
+            (f'Записано в базу {sum(1 for item in results if item)} '
+             f'из {len(batch)} поисковых запросов'))
+
+    def _run(self) -> None:
+        is_stopping = False
+        while not is_stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is None:
+                    is_stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        '''
+        Запись всех оставшихся в очереди запросов и сведений об отелях
+        и остановка потока
+        '''
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        self._queue.put(None)
+        thread.join(timeout)
+
+
+history_writer = HistoryWriter()
+atexit.register(history_writer.stop)
@@ -0,0 +1,121 @@
+import datetime
+import gzip
+import json
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from config_data import config
+from database.models import db
+from database.tools import CRUD
+
+ARCHIVE_BATCH_SIZE = 500
+
+
+def archive_requests(
+        requests_ids: List[int]) -> Tuple[Optional[str], List[int]]:
+    '''
+    Выгрузка запросов с отелями в сжатый файл JSON Lines
+    в каталоге HISTORY_ARCHIVE_DIR. Возвращает путь к файлу и id
+    записанных в него запросов. При ошибке чтения базы или записи
+    файла исключение пробрасывается.
+    '''
+    archived_ids = []
+    if not requests_ids:
+        return None, archived_ids
+    os.makedirs(config.HISTORY_ARCHIVE_DIR, exist_ok=True)
+    archive_path = os.path.join(
+        config.HISTORY_ARCHIVE_DIR,
+        f'history-{datetime.datetime.now():%Y%m%d-%H%M%S}.jsonl.gz')
+    with gzip.open(archive_path, 'at', encoding='utf-8') as archive:
+        for start in range(0, len(requests_ids), ARCHIVE_BATCH_SIZE):
+            requests = CRUD.get_requests_with_hotels(
+                requests_ids[start:start + ARCHIVE_BATCH_SIZE])
+            for request in requests:
+                archive.write(
+                    json.dumps(request, ensure_ascii=False, default=str))
+                archive.write('\n')
+                archived_ids.append(request['id'])
+    return archive_path, archived_ids
+
+
+def incremental_vacuum(pages: int) -> None:
+    '''
+    Освобождение до pages свободных страниц файла базы.
+    При первом запуске база переводится в режим auto_vacuum=INCREMENTAL
+    полным VACUUM.
+    '''
+    with db.connection_context():
+        auto_vacuum, = db.execute_sql('PRAGMA auto_vacuum').fetchone()
+        if auto_vacuum != 2:
+            logger.debug('Перевод базы в режим auto_vacuum=INCREMENTAL')
+            db.execute_sql('PRAGMA auto_vacuum = INCREMENTAL')
+            db.execute_sql('VACUUM')
+        else:
+            db.execute_sql(f'PRAGMA incremental_vacuum({int(pages)})')
+
+
+def run_maintenance() -> Dict[str, int]:
+    '''
+    Обслуживание базы: выгрузка в архив и удаление устаревших запросов
+    и запросов сверх лимита на пользователя, удаление отелей без истории
+    и освобождение места в файле базы.
+    '''
+    now = datetime.datetime.now()
+    expired_ids = CRUD.get_expired_requests_ids(
+        created_before=now - datetime.timedelta(
+            days=config.HISTORY_RETENTION_DAYS),
+        max_requests_per_user=config.HISTORY_MAX_REQUESTS_PER_USER
+    ) or []
+    # Удаляются только запросы, записанные в архив. Ошибка выгрузки
+    # прерывает обслуживание до удаления
+    archive_path, archived_ids = archive_requests(expired_ids)
+    deleted_requests = 0
+    for start in range(0, len(archived_ids), ARCHIVE_BATCH_SIZE):
+        deleted_requests += CRUD.delete_requests(
+            archived_ids[start:start + ARCHIVE_BATCH_SIZE]) or 0
+    deleted_hotels = CRUD.delete_orphaned_hotels(
+        details_updated_before=now - datetime.timedelta(
+            seconds=config.HOTEL_DETAILS_CACHE_TTL)
+    ) or 0
+    incremental_vacuum(config.MAINTENANCE_VACUUM_PAGES)
+    logger.debug(
+        (f'Обслуживание базы: удалено запросов {deleted_requests}, '
+         f'отелей {deleted_hotels}, архив {archive_path}'))
+    return {
+        'deleted_requests': deleted_requests,
+        'deleted_hotels': deleted_hotels,
+    }
+
+
+class MaintenanceJob:
+    '''Периодический запуск обслуживания базы в фоновом потоке'''
+
+    def __init__(self,
+                 interval: float = config.MAINTENANCE_INTERVAL) -> None:
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                run_maintenance()
+            except Exception as error:
+                logger.exception(f'Ошибка обслуживания базы: {error}')
+            self._stop_event.wait(self.interval)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name='db-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+maintenance_job = MaintenanceJob()
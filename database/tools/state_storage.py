@@ -0,0 +1,230 @@
+import atexit
+import datetime
+import json
+import threading
+import time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from loguru import logger
+from telebot.storage import StateContext, StateStorageBase
+
+from config_data import config
+from database.tools import CRUD
+
+
+def _encode_value(value: Any) -> Any:
+    '''Кодирование дат для JSON: {"$dt": ...} и {"$d": ...}'''
+    if isinstance(value, datetime.datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'$d': value.isoformat()}
+    raise TypeError(f'Тип {type(value)} не поддерживается')
+
+
+def _decode_object(value: Dict) -> Any:
+    if len(value) == 1:
+        if '$dt' in value:
+            return datetime.datetime.fromisoformat(value['$dt'])
+        if '$d' in value:
+            return datetime.date.fromisoformat(value['$d'])
+    return value
+
+
+def dumps_data(data: Dict) -> str:
+    '''Компактная сериализация данных диалога с сохранением дат'''
+    return json.dumps(data, default=_encode_value,
+                      ensure_ascii=False, separators=(',', ':'))
+
+
+def loads_data(data: str) -> Dict:
+    '''Восстановление данных диалога из dumps_data'''
+    return json.loads(data, object_hook=_decode_object)
+
+
+class SqliteStateStorage(StateStorageBase):
+    '''
+    Хранилище состояний диалогов в базе бота.
+    Состояния хранятся в памяти и записываются в базу пачкой раз
+    в flush_interval секунд, поэтому частые изменения данных диалога
+    не приводят к записи на диск при каждом изменении.
+    Диалоги без изменений дольше ttl секунд считаются брошенными
+    и удаляются.
+    '''
+
+    def __init__(self,
+                 ttl: float = config.STATE_TTL,
+                 flush_interval: float = config.STATE_FLUSH_INTERVAL
+                 ) -> None:
+        super().__init__()
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._entries: Dict[Tuple[int, int], Dict] = {}
+        self._dirty: Set[Tuple[int, int]] = set()
+        self._deleted: Set[Tuple[int, int]] = set()
+        self._lock = threading.RLock()
+        self._is_loaded = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.stop)
+
+    def _start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, name='state-storage', daemon=True)
+            self._thread.start()
+
+    def _is_expired(self, entry: Dict) -> bool:
+        return time.time() - entry['updated_at'] > self.ttl
+
+    def _load(self) -> None:
+        '''Загрузка из базы незавершенных диалогов при первом обращении'''
+        if self._is_loaded:
+            return
+        self._is_loaded = True
+        stored_states = CRUD.get_dialog_states(time.time() - self.ttl) or []
+        for chat_id, user_id, state, data, updated_at in stored_states:
+            self._entries.setdefault((chat_id, user_id), {
+                'state': state,
+                'data': loads_data(data),
+                'updated_at': updated_at,
+            })
+        logger.debug(f'Загружено {len(stored_states)} состояний диалогов')
+
+    def _get_entry(self, chat_id: int, user_id: int) -> Optional[Dict]:
+        self._load()
+        key = (chat_id, user_id)
+        entry = self._entries.get(key)
+        if entry is not None and self._is_expired(entry):
+            self._remove(key)
+            return None
+        return entry
+
+    def _touch(self, key: Tuple[int, int]) -> None:
+        self._entries[key]['updated_at'] = time.time()
+        self._dirty.add(key)
+        self._deleted.discard(key)
+        self._start()
+
+    def _remove(self, key: Tuple[int, int]) -> None:
+        self._entries.pop(key, None)
+        self._dirty.discard(key)
+        self._deleted.add(key)
+        self._start()
+
+    def set_state(self, chat_id, user_id, state):
+        if hasattr(state, 'name'):
+            state = state.name
+        with self._lock:
+            entry = self._get_entry(chat_id, user_id)
+            if entry is None:
+                self._entries[(chat_id, user_id)] = {
+                    'state': state, 'data': {}, 'updated_at': 0}
+            else:
+                entry['state'] = state
+            self._touch((chat_id, user_id))
+        return True
+
+    def delete_state(self, chat_id, user_id):
+        with self._lock:
+            if self._get_entry(chat_id, user_id) is None:
+                return False
+            self._remove((chat_id, user_id))
+            return True
+
+    def get_state(self, chat_id, user_id):
+        with self._lock:
+            entry = self._get_entry(chat_id, user_id)
+            return entry['state'] if entry is not None else None
+
+    def get_data(self, chat_id, user_id):
+        with self._lock:
+            entry = self._get_entry(chat_id, user_id)
+            return entry['data'] if entry is not None else None
+
+    def reset_data(self, chat_id, user_id):
+        with self._lock:
+            if self._get_entry(chat_id, user_id) is None:
+                return False
+            self._entries[(chat_id, user_id)]['data'] = {}
+            self._touch((chat_id, user_id))
+            return True
+
+    def set_data(self, chat_id, user_id, key, value):
+        with self._lock:
+            entry = self._get_entry(chat_id, user_id)
+            if entry is None:
+                raise RuntimeError(
+                    f'chat_id {chat_id} and user_id {user_id} does not exist')
+            entry['data'][key] = value
+            self._touch((chat_id, user_id))
+            return True
+
+    def get_interactive_data(self, chat_id, user_id):
+        return StateContext(self, chat_id, user_id)
+
+    def save(self, chat_id, user_id, data):
+        with self._lock:
+            if self._get_entry(chat_id, user_id) is None:
+                return
+            self._entries[(chat_id, user_id)]['data'] = data
+            self._touch((chat_id, user_id))
+
+    def flush(self) -> bool:
+        '''Запись измененных и удаленных диалогов в базу'''
+        with self._lock:
+            dialog_states = [
+                {
+                    'chat_id': chat_id,
+                    'user_id': user_id,
+                    'state': self._entries[(chat_id, user_id)]['state'],
+                    'data': dumps_data(
+                        self._entries[(chat_id, user_id)]['data']),
+                    'updated_at': (
+                        self._entries[(chat_id, user_id)]['updated_at']),
+                }
+                for chat_id, user_id in self._dirty
+            ]
+            deleted_keys = list(self._deleted)
+            self._dirty.clear()
+            self._deleted.clear()
+        if not dialog_states and not deleted_keys:
+            return True
+        is_saved = CRUD.save_dialog_states(dialog_states, deleted_keys)
+        if not is_saved:
+            with self._lock:
+                for dialog_state in dialog_states:
+                    key = (dialog_state['chat_id'], dialog_state['user_id'])
+                    if key in self._entries:
+                        self._dirty.add(key)
+                self._deleted.update(
+                    key for key in deleted_keys if key not in self._entries)
+        return bool(is_saved)
+
+    def remove_expired(self) -> None:
+        '''Удаление брошенных диалогов из памяти и из базы'''
+        with self._lock:
+            for key in [key for key, entry in self._entries.items()
+                        if self._is_expired(entry)]:
+                self._entries.pop(key)
+                self._dirty.discard(key)
+        CRUD.delete_expired_dialog_states(time.time() - self.ttl)
+
+    def _run(self) -> None:
+        last_cleanup_at = time.monotonic()
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() - last_cleanup_at > self.ttl / 10:
+                    self.remove_expired()
+                    last_cleanup_at = time.monotonic()
+            except Exception as error:
+                logger.exception(
+                    f'Ошибка записи состояний диалогов: {error}')
+
+    def stop(self) -> None:
+        '''Остановка фоновой записи с сохранением всех изменений'''
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -3,7 +3,7 @@ from telebot.types import CallbackQuery, InlineKeyboardButton, Message
 from telegram_bot_pagination import InlineKeyboardPaginator
 
 from database.tools import CRUD
-from loader import bot
+from loader import bot, sender
 
 
 @logger.catch
@@ -19,7 +19,7 @@ def get_character(message: Message) -> None:
 def history_page_callback(callback_query: CallbackQuery) -> None:
     '''Обработка нажатия кнопок выбора соответсующей истории запроса'''
     page = int(callback_query.data.split('#')[1])
-    bot.delete_message(
+    sender.delete_message(
         callback_query.message.chat.id,
         callback_query.message.message_id
     )
@@ -35,7 +35,7 @@ def history_item_delete_callback(callback_query: CallbackQuery) -> None:
     page = int(callback_query.data.split('#')[1])
     logger.debug(f'Удаление запроса с id {page}')
     is_request_completed = CRUD.delete_user_request(page)
-    bot.delete_message(
+    sender.delete_message(
         callback_query.message.chat.id,
         callback_query.message.message_id
     )
@@ -49,20 +49,20 @@ def send_history_page(message: Message, user_id: int, page: int = 1) -> None:
     '''Вывод пользователю результат запроса из его истории поиска'''
     logger.debug(
         f'{message.from_user.username} запросил историю запросов.')
-    is_request_completed, requests_history = CRUD.get_user_requests(
-        user_id)
-    if is_request_completed and len(requests_history) > 0:
-        request_id = requests_history[page-1].id
+    (is_request_completed,
+     requests_count,
+     page,
+     request) = CRUD.get_user_requests_page(user_id, page)
+    if is_request_completed and requests_count > 0:
         paginator = InlineKeyboardPaginator(
-            len(requests_history),
+            requests_count,
             current_page=page,
             data_pattern='character#{page}'
         )
         paginator.add_before(
             InlineKeyboardButton('Удалить из истории',
-                                 callback_data='delete#{}'.format(request_id))
+                                 callback_data='delete#{}'.format(request.id))
         )
-        request = requests_history[page-1]
         result_message = (f'Дата запроса: {request.created_at}\n'
                           f'Команда: {request.command}\n'
                           f'Город: {request.city}\n'
@@ -87,14 +87,14 @@ def send_history_page(message: Message, user_id: int, page: int = 1) -> None:
                                f'дистанция  <b>{item.hotel.distance}км</b> '
                                f'цена  <b>{item.hotel_price}$</b>'
                                )
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             result_message,
             reply_markup=paginator.markup,
             parse_mode='html'
         )
     else:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'История пуста.'
         )
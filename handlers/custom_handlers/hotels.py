@@ -1,21 +1,63 @@
 import datetime
+import functools
+import html
+import re
+import time
+from typing import Callable, List, Sequence, Union
 
 from dateutil.relativedelta import relativedelta
 from loguru import logger
-from telebot.types import CallbackQuery, Message
+from telebot.types import CallbackQuery, InputMediaPhoto, Message
 from telegram_bot_calendar import DetailedTelegramCalendar
 
 from api import hotels_service
 from config_data import config
-from database.tools import CRUD
+from database.tools.history_writer import history_writer
 from keyboards.inline.cities_keyboard import cities_keyboard
 from keyboards.reply.bool_keyboard import bool_keyboard
-from loader import bot
+from loader import bot, sender
 from states.hotels_query import HotelQueryState
+from utils.misc.metrics import track_handler
+from utils.misc.rate_limiter import PRIORITY_BULK
+from utils.misc.records import HotelResult
+from utils.misc.tracing import get_current_trace_id, new_trace_id, tracer
+
+
+def trace_dialog_step(is_dialog_start: bool = False) -> Callable:
+    '''
+    Декоратор шага диалога: обработчик выполняется в span трассировки,
+    id которой хранится в данных состояния диалога. В начале диалога
+    создается новая трассировка.
+    '''
+
+    def decorator(handler: Callable) -> Callable:
+
+        @functools.wraps(handler)
+        def wrapper(update_object: Union[Message, CallbackQuery]) -> None:
+            if not tracer.enabled:
+                return handler(update_object)
+            user_id = update_object.from_user.id
+            message = (update_object.message
+                       if isinstance(update_object, CallbackQuery)
+                       else update_object)
+            trace_id = None
+            if not is_dialog_start:
+                data = bot.current_states.get_data(message.chat.id, user_id)
+                trace_id = (data or {}).get('trace_id')
+            with tracer.span(handler.__name__,
+                             trace_id=trace_id or new_trace_id(),
+                             user_id=user_id):
+                return handler(update_object)
+
+        return wrapper
+
+    return decorator
 
 
 @logger.catch
 @bot.message_handler(commands=['high', 'low', 'bestdeals'])
+@track_handler
+@trace_dialog_step(is_dialog_start=True)
 def initial_point(message: Message) -> None:
     '''
     Обработка комманд 'high', 'low', 'bestdeals' бота.
@@ -26,7 +68,7 @@ def initial_point(message: Message) -> None:
         message.from_user.id,
         HotelQueryState.city,
         message.chat.id)
-    bot.send_message(
+    sender.send_message(
         message.from_user.id,
         f'Введите название города'
     )
@@ -34,10 +76,13 @@ def initial_point(message: Message) -> None:
         f'{message.from_user.username} ввел команду {command_received}')
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
         data['command'] = command_received
+        data['trace_id'] = get_current_trace_id()
 
 
 @logger.catch
 @bot.message_handler(state=HotelQueryState.city, regexp=r'[а-яА-Я -]{3,}')
+@track_handler
+@trace_dialog_step()
 def ask_city(message: Message) -> None:
     '''
     Запрос к API на получение ID локация на основание названия города.
@@ -52,7 +97,7 @@ def ask_city(message: Message) -> None:
              f'сделал запрос для города {recived_cityname}. '
              f'Были получены локации {cities_array}')
         )
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'Уточните выбор города из результатов поиска',
             reply_markup=cities_keyboard(cities_array)
@@ -69,7 +114,7 @@ def ask_city(message: Message) -> None:
              f'По данному городу {recived_cityname} ничего не найдено!'
              f'Были получены локации {cities_array}')
         )
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             (f'По данному городу {recived_cityname} ничего не найдено! '
              'Повторите попытку с другим городом.')
@@ -80,7 +125,7 @@ def ask_city(message: Message) -> None:
              'Не получилось выполнить запрос на получения id локации!'
              )
         )
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'Не получилось выполнить запрос! Повторите попытку позже!'
         )
@@ -89,6 +134,8 @@ def ask_city(message: Message) -> None:
 @logger.catch
 @ bot.callback_query_handler(
     lambda callback_query: 'city:' in callback_query.data)
+@track_handler
+@trace_dialog_step()
 def city_callback(callback_query: CallbackQuery) -> None:
     '''Запрос количества отелей для поиска.
     Обработка ввода id c клавиатуры локаций.
@@ -100,7 +147,7 @@ def city_callback(callback_query: CallbackQuery) -> None:
         (f'Пользователь {callback_query.from_user.username}, '
          f'выбрал id города: {city_id_selected}')
     )
-    bot.send_message(
+    sender.send_message(
         callback_query.from_user.id,
         ('Введите нужное количество отелей? '
          f'Не больше {config.HOTEL_REQUESTS_LIMIT}')
@@ -118,6 +165,8 @@ def city_callback(callback_query: CallbackQuery) -> None:
 
 @logger.catch
 @ bot.message_handler(state=HotelQueryState.hotels_count)
+@track_handler
+@trace_dialog_step()
 def ask_enter_date(message: Message) -> None:
     '''
     Запрос даты заезда в отель.
@@ -132,7 +181,7 @@ def ask_enter_date(message: Message) -> None:
             min_date=current_date,
             max_date=current_date + relativedelta(years=1)
         ).build()
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             f'Выберите дату заезда',
             reply_markup=calendar
@@ -144,7 +193,7 @@ def ask_enter_date(message: Message) -> None:
         with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
             data['hotels_count'] = int(message.text)
     else:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             ('Ошибка! Введите количество отелей целым положительным '
              f'чилом больше 0 но меньше {config.HOTEL_REQUESTS_LIMIT}')
@@ -153,6 +202,8 @@ def ask_enter_date(message: Message) -> None:
 
 @logger.catch
 @ bot.callback_query_handler(func=DetailedTelegramCalendar.func())
+@track_handler
+@trace_dialog_step()
 def start_end_date_call(callback_query) -> None:
     '''Обработка ввода даты заезда/выезда полученной с клавиатуры'''
     result, key = None, None
@@ -169,7 +220,7 @@ def start_end_date_call(callback_query) -> None:
                 locale='ru',
                 min_date=new_start_date).process(callback_query.data)
     if not result and key:
-        bot.edit_message_text(
+        sender.edit_message_text(
             "Введите дату",
             callback_query.message.chat.id,
             callback_query.message.message_id,
@@ -184,20 +235,20 @@ def start_end_date_call(callback_query) -> None:
                 calendar, _ = DetailedTelegramCalendar(
                     locale='ru',
                     min_date=result + relativedelta(days=1)).build()
-                bot.edit_message_text("Выберите дату выезда",
-                                      callback_query.message.chat.id,
-                                      callback_query.message.message_id,
-                                      reply_markup=calendar)
+                sender.edit_message_text("Выберите дату выезда",
+                                         callback_query.message.chat.id,
+                                         callback_query.message.message_id,
+                                         reply_markup=calendar)
             elif not data.get('end_date'):
                 data['end_date'] = result
                 data['total_days'] = (
                     data['end_date'] - data['enter_date']).days
-                bot.edit_message_reply_markup(
+                sender.edit_message_reply_markup(
                     callback_query.message.chat.id,
                     callback_query.message.message_id,
                     reply_markup=None
                 )
-                bot.send_message(
+                sender.send_message(
                     callback_query.from_user.id,
                     'Нужны ли изображения отелей?',
                     reply_markup=bool_keyboard()
@@ -210,10 +261,12 @@ def start_end_date_call(callback_query) -> None:
 
 @logger.catch
 @ bot.message_handler(state=HotelQueryState.is_images_needed)
+@track_handler
+@trace_dialog_step()
 def ask_is_images_needed(message: Message) -> None:
     '''Обработка условия требуются ли фотографии в запросе'''
     if message.text == 'Да':
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             ('Cколько изображений каждого отеля требуется? '
              f'(Не больше {config.HOTEL_PHOTOS_LIMIT})')
@@ -231,7 +284,7 @@ def ask_is_images_needed(message: Message) -> None:
             data['is_images_needed'] = False
             data['images_count'] = 0
         if command == '/bestdeals':
-            bot.send_message(
+            sender.send_message(
                 message.chat.id,
                 'Укажите динстанцию для поиска.')
             bot.set_state(
@@ -242,104 +295,216 @@ def ask_is_images_needed(message: Message) -> None:
             final_step(message)
 
 
+def _escape(text: str, max_length: int) -> str:
+    '''Экранирование текста для parse_mode html с обрезкой'''
+    text = str(text)
+    if len(text) > max_length:
+        text = f'{text[:max_length - 1]}…'
+    return html.escape(text)
+
+
+def _get_text_length(html_text: str) -> int:
+    '''Длина текста сообщения без разметки, как ее считает Telegram'''
+    text = html.unescape(re.sub(r'<[^>]*>', '', html_text))
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _format_hotel_line(number: int,
+                       hotel: HotelResult,
+                       total_price: float,
+                       is_ok_status: bool = True) -> str:
+    '''Строка с информацией об отеле для сводного сообщения'''
+    name = _escape(hotel.name, config.HOTEL_NAME_MAX_LENGTH)
+    line = (f"{number}. <b>{name}</b> цена за ночь: "
+            f"<b>{hotel.price}$</b>, за указанный период "
+            f"<b>{total_price}$</b>, расстояние <b>{hotel.distance}</b>км")
+    if not is_ok_status:
+        return f'{line}\nНе удалось получить дополнительную информацию'
+    if hotel.address is None:
+        return f'{line}\nадресс: загружается...'
+    address = _escape(hotel.address, config.HOTEL_ADDRESS_MAX_LENGTH)
+    return f'{line}\nадресс: {address}'
+
+
+def _format_hotel_caption(hotel: HotelResult, total_price: float) -> str:
+    '''Подпись к фотографиям отеля'''
+    return (f'<b>{_escape(hotel.name, config.HOTEL_NAME_MAX_LENGTH)}</b>\n'
+            f'{hotel.price}$ за ночь, {total_price}$ за период, '
+            f'{hotel.distance}км\n'
+            f'{_escape(hotel.address, config.HOTEL_ADDRESS_MAX_LENGTH)}')
+
+
+def _send_hotel_photos(chat_id: int,
+                       caption: str,
+                       images_links: Sequence[str]) -> None:
+    '''
+    Отправка фотографий отеля альбомами по MEDIA_GROUP_LIMIT штук.
+    Подпись с информацией об отеле добавляется к первой фотографии.
+    '''
+    for start in range(0, len(images_links), config.MEDIA_GROUP_LIMIT):
+        chunk = images_links[start:start + config.MEDIA_GROUP_LIMIT]
+        chunk_caption = caption if start == 0 else None
+        if len(chunk) == 1:
+            sender.send_photo(
+                chat_id, chunk[0], caption=chunk_caption, parse_mode='html')
+            continue
+        media = [
+            InputMediaPhoto(
+                image_link,
+                caption=chunk_caption if number == 0 else None,
+                parse_mode='html')
+            for number, image_link in enumerate(chunk)
+        ]
+        sender.send_media_group(chat_id, media)
+
+
+def _build_summary(header: str, hotels_lines: List[str]) -> List[str]:
+    '''
+    Тексты сводных сообщений с результатами поиска, каждый не длиннее
+    TELEGRAM_MESSAGE_LIMIT. Строки отелей не разрываются между
+    сообщениями.
+    '''
+    texts = [header]
+    for line in hotels_lines:
+        text = f'{texts[-1]}\n\n{line}'
+        if _get_text_length(text) <= config.TELEGRAM_MESSAGE_LIMIT:
+            texts[-1] = text
+        else:
+            texts.append(line)
+    return texts
+
+
+def _show_summary(chat_id: int,
+                  messages: List[Message],
+                  texts: List[str],
+                  new_texts: List[str]) -> None:
+    '''
+    Обновление сводных сообщений: измененные тексты редактируются,
+    недостающие сообщения отправляются, лишние удаляются.
+    messages дополняется отправленными сообщениями.
+    '''
+    for number, text in enumerate(new_texts):
+        if number >= len(messages):
+            messages.append(sender.send_message(
+                chat_id, text, priority=PRIORITY_BULK, parse_mode='html'))
+        elif text != texts[number]:
+            sender.edit_message_text(
+                text,
+                chat_id,
+                messages[number].message_id,
+                priority=PRIORITY_BULK,
+                parse_mode='html')
+    for summary_message in messages[len(new_texts):]:
+        sender.delete_message(
+            chat_id, summary_message.message_id, priority=PRIORITY_BULK)
+    del messages[len(new_texts):]
+
+
 @logger.catch
+@track_handler
+@trace_dialog_step()
 def final_step(message: Message) -> None:
-    '''Запрос и получение результата поиска. Вывод результата пользователю.'''
+    '''
+    Запрос и получение результата поиска. Вывод результата пользователю.
+    Список найденных отелей отправляется сразу сводным сообщением
+    (несколькими, если не помещается в одно), которое дополняется
+    адресами по мере получения сведений об отелях.
+    '''
     with bot.retrieve_data(message.from_user.id, message.chat.id) as data:
-        (response_status,
-         response_data) = hotels_service.search_hotels_for_location(
-            region_id=data.get('city_id'),
-            limit=data.get('hotels_count'),
-            checkInDate=data.get('enter_date'),
-            checkOutDate=data.get('end_date'),
-            distance=data.get('distance', None),
-            low_price=data.get('low_price', None),
-            high_price=data.get('high_price', None),
-            command=data.get('command')
-        )
-        logger.debug(
-            f"Пользователь {message.from_user.username} данные для запроса "
-            f"Команда: {data['command']}\n"
-            f"Имя города: {data['city']}\n"
-            f"ID города City ID: {data['city_id']}\n"
-            f"Дата заезда: {data['enter_date']}\n"
-            f"Дата отъезда: {data['end_date']}\n"
-            f"Количетсво отелей: {data['hotels_count']}\n"
-            f"Нужны ли фото: {data['is_images_needed']}\n"
-            f"Количество фото для запроса: {data['images_count']}\n")
-        if response_status:
-            hotels = []
-            for (hotel_id,
-                 hotel_name,
-                 hotel_price,
-                 destination) in response_data:
-                (is_ok_status,
-                 address,
-                 images_links) = hotels_service.get_hotel_details(
-                    hotel_id=hotel_id,
-                    is_images_needed=data['is_images_needed'],
-                    image_limit=int(data['images_count'])
-                )
-                if is_ok_status:
-                    total_price = round(data['total_days']*hotel_price, 2)
-                    msg = (f"Название отеля <b>{hotel_name}</b> цена за ночь: "
-                           f"<b>{hotel_price}$</b> цена за указанный период "
-                           f"<b>{total_price}$</b>, расстояние <b>"
-                           f"{destination}</b>км, адресс: {address}")
-                    bot.send_message(message.chat.id, msg,
-                                     parse_mode='html')
-                    for image_link in images_links:
-                        bot.send_photo(message.chat.id, image_link)
-                    hotel_info = {
-                        'id': hotel_id,
-                        'name': hotel_name,
-                        'address': address,
-                        'destination': destination,
-                        'hotel_price': hotel_price
-                    }
-                    hotels.append(hotel_info)
-                else:
-                    bot.send_message(
-                        message.chat.id,
-                        ('Не удалось дополнительную '
-                         f'получить информацию об отеле {hotel_name}'),
-                        parse_mode='html')
-            bot.send_message(message.chat.id, f'Поиск завершен.')
-            write_request_completed = CRUD.write_request_to_history(
-                created_at=datetime.datetime.now().isoformat(' ', 'seconds'),
-                user=message.from_user.id,
-                command=data['command'],
-                city=data['city'],
-                start_date=data['enter_date'],
-                end_date=data['end_date'],
-                hotels_count=data['hotels_count'],
-                hotels=hotels,
-                is_images_needed=data['is_images_needed'],
-                images_count=data['images_count'],
-                distance=data.get('distance', None),
-                low_price=data.get('low_price', None),
-                high_price=data.get('high_price', None)
-            )
-            if write_request_completed:
-                logger.debug(
-                    ('Данные поискового запроса и полученные результ '
-                     'были записаны в базу данных')
-                )
-            else:
-                logger.error(
-                    ('Данные поискового запроса и полученные результ '
-                     f'не были записаны в базу данных')
-                )
+        data = dict(data)
+    (response_status,
+     response_data) = hotels_service.search_hotels_for_location(
+        region_id=data.get('city_id'),
+        limit=data.get('hotels_count'),
+        checkInDate=data.get('enter_date'),
+        checkOutDate=data.get('end_date'),
+        distance=data.get('distance', None),
+        low_price=data.get('low_price', None),
+        high_price=data.get('high_price', None),
+        command=data.get('command')
+    )
+    logger.debug(
+        f"Пользователь {message.from_user.username} данные для запроса "
+        f"Команда: {data['command']}\n"
+        f"Имя города: {data['city']}\n"
+        f"ID города City ID: {data['city_id']}\n"
+        f"Дата заезда: {data['enter_date']}\n"
+        f"Дата отъезда: {data['end_date']}\n"
+        f"Количетсво отелей: {data['hotels_count']}\n"
+        f"Нужны ли фото: {data['is_images_needed']}\n"
+        f"Количество фото для запроса: {data['images_count']}\n")
+    if not response_status or not response_data:
+        if (not response_status
+                and not hotels_service.is_service_available()):
+            msg = ('Сервис поиска отелей сейчас не отвечает. '
+                   'Повторите попытку через несколько минут')
         else:
             msg = ('Нет данных по данному запросу. '
                    f'Повторите попытку позже или измените параметры запроса')
-            logger.error(msg)
-            bot.send_message(message.chat.id, msg, parse_mode='html')
+        logger.error(msg)
+        sender.send_message(message.chat.id, msg, parse_mode='html')
+        bot.delete_state(message.from_user.id, message.chat.id)
+        return
+    total_prices = [
+        round(data['total_days'] * hotel.price, 2) for hotel in response_data
+    ]
+    hotels_lines = [
+        _format_hotel_line(number, hotel, total_price)
+        for number, (hotel, total_price)
+        in enumerate(zip(response_data, total_prices), start=1)
+    ]
+    summary_texts = _build_summary('Найденные отели:', hotels_lines)
+    summary_messages = []
+    _show_summary(message.chat.id, summary_messages, [], summary_texts)
+    last_edit_at = time.monotonic()
+    hotels = [None] * len(response_data)
+    for index, is_ok_status, hotel in hotels_service.iter_hotels_details(
+            hotels=response_data,
+            is_images_needed=data['is_images_needed'],
+            image_limit=int(data['images_count'])):
+        hotels_lines[index] = _format_hotel_line(
+            index + 1, hotel, total_prices[index], is_ok_status)
+        if not is_ok_status:
+            continue
+        if hotel.images:
+            _send_hotel_photos(
+                message.chat.id,
+                _format_hotel_caption(hotel, total_prices[index]),
+                hotel.images)
+        hotels[index] = hotel
+        if time.monotonic() - last_edit_at >= config.RESULTS_EDIT_INTERVAL:
+            new_summary_texts = _build_summary(
+                'Найденные отели:', hotels_lines)
+            if new_summary_texts != summary_texts:
+                _show_summary(message.chat.id, summary_messages,
+                              summary_texts, new_summary_texts)
+                summary_texts = new_summary_texts
+                last_edit_at = time.monotonic()
+    _show_summary(
+        message.chat.id, summary_messages, summary_texts,
+        _build_summary('Поиск завершен. Найденные отели:', hotels_lines))
+    history_writer.submit(
+        created_at=datetime.datetime.now().isoformat(' ', 'seconds'),
+        user=message.from_user.id,
+        command=data['command'],
+        city=data['city'],
+        start_date=data['enter_date'],
+        end_date=data['end_date'],
+        hotels_count=data['hotels_count'],
+        hotels=[hotel for hotel in hotels if hotel is not None],
+        is_images_needed=data['is_images_needed'],
+        images_count=data['images_count'],
+        distance=data.get('distance', None),
+        low_price=data.get('low_price', None),
+        high_price=data.get('high_price', None)
+    )
     bot.delete_state(message.from_user.id, message.chat.id)
 
 
 @logger.catch
 @ bot.message_handler(state=HotelQueryState.images_count, is_digit=True)
+@track_handler
+@trace_dialog_step()
 def ask_images_count(message: Message) -> None:
     '''
     Обработка условия запроса фотографий.
@@ -353,7 +518,7 @@ def ask_images_count(message: Message) -> None:
         if command in ('/low', '/high'):
             final_step(message)
         elif command == '/bestdeals':
-            bot.send_message(
+            sender.send_message(
                 message.chat.id,
                 'Укажите динстанцию для поиска.')
             bot.set_state(
@@ -361,7 +526,7 @@ def ask_images_count(message: Message) -> None:
                 HotelQueryState.distance,
                 message.chat.id)
     else:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             ('Ошибка! Введите количество фотографий целым положительным'
              f'чилом больше 0 но меньше {config.HOTEL_PHOTOS_LIMIT}')
@@ -369,12 +534,14 @@ def ask_images_count(message: Message) -> None:
 
 
 @ bot.message_handler(state=HotelQueryState.distance, is_digit=True)
+@track_handler
+@trace_dialog_step()
 def ask_distance(message: Message) -> None:
     '''
     Обработка условия запроса фотографий.
     Обработка ввода даты заезда/выезда полученной с клавиатуры
     '''
-    bot.send_message(
+    sender.send_message(
         message.chat.id,
         'Укажите минимальную цену за номер')
     bot.set_state(
@@ -387,15 +554,17 @@ def ask_distance(message: Message) -> None:
 
 @logger.catch
 @ bot.message_handler(state=HotelQueryState.low_price, is_digit=True)
+@track_handler
+@trace_dialog_step()
 def ask_low_price(message: Message) -> None:
     price = int(message.text)
     if price < 0:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'Вы ввели некоректную цену, меньше 0! Повторите попытку!'
         )
     else:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'Укажите маскимальную цену за номер')
         bot.set_state(
@@ -408,6 +577,8 @@ def ask_low_price(message: Message) -> None:
 
 @logger.catch
 @ bot.message_handler(state=HotelQueryState.high_price, is_digit=True)
+@track_handler
+@trace_dialog_step()
 def get_high_price(message: Message) -> None:
     '''
     Проверка ввода максимальной цены,
@@ -416,12 +587,12 @@ def get_high_price(message: Message) -> None:
         low_price = data['low_price']
     price = int(message.text)
     if price < 0:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'Вы ввели некоректную цену, меньше 0! Повторите попытку!'
         )
     elif price < low_price:
-        bot.send_message(
+        sender.send_message(
             message.chat.id,
             'Вы ввели максимальную цену меньше минимальной! Повторите попытку!'
         )
@@ -448,8 +619,10 @@ def get_high_price(message: Message) -> None:
 
 
 @ bot.message_handler(state=HotelQueryState.city)
+@track_handler
+@trace_dialog_step()
 def hotels_city_name_incorrect(message: Message) -> None:
-    bot.send_message(
+    sender.send_message(
         message.chat.id,
         ('Вы ввели не некоректое название города. '
          'Требуются символы кирилицы! Повторите попытку.'))
@@ -460,6 +633,8 @@ def hotels_city_name_incorrect(message: Message) -> None:
 @ bot.message_handler(state=HotelQueryState.distance, is_digit=False)
 @ bot.message_handler(state=HotelQueryState.images_count, is_digit=False)
 @ bot.message_handler(state=HotelQueryState.hotels_count, is_digit=False)
+@track_handler
+@trace_dialog_step()
 def hotels_digit_incorrect(message: Message) -> None:
-    bot.send_message(
+    sender.send_message(
         message.chat.id, 'Вы ввели не число. Повторите попытку.')
@@ -1,12 +1,12 @@
 from loguru import logger
 from telebot.types import Message
 
-from loader import bot
+from loader import bot, sender
 
 
 @logger.catch
 @bot.message_handler(state=None)
 def bot_echo(message: Message):
     '''Вывод сообщения для несуществующих комманд'''
-    bot.reply_to(message, ("Данной команды не существует! "
-                           "Список доступные команд /help"))
+    sender.reply_to(message, ("Данной команды не существует! "
+                              "Список доступные команд /help"))
@@ -2,7 +2,7 @@ from loguru import logger
 from telebot.types import Message
 
 from config_data.config import DEFAULT_COMMANDS
-from loader import bot
+from loader import bot, sender
 
 
 @logger.catch
@@ -10,4 +10,4 @@ from loader import bot
 def bot_help(message: Message):
     '''Вывод сообщения с списком существующих комманд'''
     text = [f'/{command} - {desk}' for command, desk in DEFAULT_COMMANDS]
-    bot.reply_to(message, '\n'.join(text))
+    sender.reply_to(message, '\n'.join(text))
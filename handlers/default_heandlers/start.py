@@ -1,11 +1,11 @@
 from loguru import logger
 from telebot.types import Message
 
-from loader import bot
+from loader import bot, sender
 
 
 @logger.catch
 @bot.message_handler(commands=['start'])
 def bot_start(message: Message):
     '''Вывод сообщения приветствия'''
-    bot.reply_to(message, f"Привет, {message.from_user.full_name}!")
+    sender.reply_to(message, f"Привет, {message.from_user.full_name}!")
@@ -7,7 +7,6 @@ cities_factory = CallbackData('city_id', 'city_name', prefix='city')
 
 
 def cities_keyboard(cities: List) -> InlineKeyboardMarkup:
-    print(cities)
     '''Возвращает клавиатуру для ввода найденных городов.'''
     return InlineKeyboardMarkup(
         keyboard=[
@@ -2,6 +2,17 @@ from telebot import TeleBot
 from telebot.storage import StateMemoryStorage
 
 from config_data import config
+from database.tools.state_storage import SqliteStateStorage
+from utils.misc.rate_limiter import SendScheduler, TelegramSender
 
-storage = StateMemoryStorage()
+if config.STATE_STORAGE == 'sqlite':
+    storage = SqliteStateStorage()
+else:
+    storage = StateMemoryStorage()
 bot = TeleBot(token=config.BOT_TOKEN, state_storage=storage)
+# Общий лимит Telegram делится между процессами-обработчиками
+send_scheduler = SendScheduler(
+    global_rate=config.TELEGRAM_GLOBAL_RATE / config.BOT_SHARDS,
+    global_burst=max(1, config.TELEGRAM_GLOBAL_BURST // config.BOT_SHARDS)
+)
+sender = TelegramSender(bot, send_scheduler)
@@ -2,13 +2,56 @@ from loguru import logger
 from telebot import custom_filters
 
 import handlers
+from config_data import config
+from database.tools.maintenance import maintenance_job
 from loader import bot
+from utils.misc.metrics import start_metrics_server
+from utils.runtime import run_async_polling
 from utils.set_bot_commands import set_default_commands
+from utils.sharding import run_sharded
+from utils.webhook import run_webhook
 
-if __name__ == '__main__':
-    logger.debug('Настройка бота')
+
+def setup_bot(is_commands_needed: bool = True) -> None:
+    '''Настройка фильтров и команд бота'''
     bot.add_custom_filter(custom_filters.StateFilter(bot))
     bot.add_custom_filter(custom_filters.IsDigitFilter())
-    set_default_commands(bot)
-    logger.debug('Запуск бота')
-    bot.infinity_polling(skip_pending=True)
+    if is_commands_needed:
+        set_default_commands(bot)
+
+
+def setup_shard_worker() -> None:
+    '''Настройка бота в процессе-обработчике'''
+    setup_bot(is_commands_needed=False)
+
+
+def check_webhook_settings() -> None:
+    '''Завершение с ошибкой, если не заданы настройки режима webhook'''
+    if not config.WEBHOOK_URL:
+        exit('Для режима webhook нужен WEBHOOK_URL - публичный HTTPS '
+             'адрес бота, например https://example.com')
+    if not config.WEBHOOK_URL.startswith('https://'):
+        exit(f'WEBHOOK_URL={config.WEBHOOK_URL} должен начинаться '
+             'с https://: Telegram отправляет обновления только по HTTPS')
+    if not config.WEBHOOK_SECRET:
+        exit('Для режима webhook нужен WEBHOOK_SECRET - секретный токен '
+             'для проверки запросов Telegram')
+
+
+if __name__ == '__main__':
+    if config.BOT_RUNTIME == 'webhook':
+        check_webhook_settings()
+    logger.debug('Настройка бота')
+    setup_bot()
+    maintenance_job.start()
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT)
+    logger.debug(f'Запуск бота в режиме {config.BOT_RUNTIME}')
+    if config.BOT_SHARDS > 1:
+        run_sharded(bot, setup_shard_worker, skip_pending=True)
+    elif config.BOT_RUNTIME == 'async':
+        run_async_polling(bot, skip_pending=True)
+    elif config.BOT_RUNTIME == 'webhook':
+        run_webhook(bot, skip_pending=True)
+    else:
+        bot.infinity_polling(skip_pending=True)
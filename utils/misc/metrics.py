@@ -0,0 +1,328 @@
+import bisect
+import contextlib
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from loguru import logger
+
+from config_data import config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape_label_value(value: str) -> str:
+    return (value.replace('\\', '\\\\')
+                 .replace('"', '\\"')
+                 .replace('\n', '\\n'))
+
+
+class _Metric:
+    '''Общая часть метрик: набор значений по значениям меток'''
+    metric_type = ''
+
+    def __init__(self,
+                 registry: 'MetricsRegistry',
+                 name: str,
+                 documentation: str,
+                 label_names: Sequence[str] = ()) -> None:
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _get_key(self, labels: Dict) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.label_names)
+
+    def _format_labels(self,
+                       key: Tuple[str, ...],
+                       extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = tuple(zip(self.label_names, key)) + extra
+        if not pairs:
+            return ''
+        return '{' + ','.join(
+            f'{name}="{_escape_label_value(value)}"'
+            for name, value in pairs) + '}'
+
+    def _render_samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        '''Строки метрики в текстовом формате Prometheus'''
+        return [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.metric_type}',
+            *self._render_samples(),
+        ]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    '''Счетчик событий, например ошибок по коду ответа'''
+    metric_type = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._get_key(labels), 0)
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{self._format_labels(key)} {value:g}'
+                for key, value in values]
+
+
+class Gauge(_Metric):
+    '''
+    Текущее значение, например глубина очереди. Значение задается
+    методом set или вычисляется функцией при отдаче метрик.
+    '''
+    metric_type = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[self._get_key(labels)] = value
+
+    def set_function(self, function: Callable[[], float], **labels) -> None:
+        '''Значение метрики вычисляется function при каждой отдаче'''
+        with self._lock:
+            self._values[self._get_key(labels)] = function
+
+    def get(self, **labels) -> float:
+        with self._lock:
+            value = self._values.get(self._get_key(labels), 0)
+        return value() if callable(value) else value
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [
+            (f'{self.name}{self._format_labels(key)} '
+             f'{value() if callable(value) else value:g}')
+            for key, value in values]
+
+
+class Histogram(_Metric):
+    '''
+    Гистограмма длительностей с фиксированными границами корзин.
+    Для каждого набора меток хранятся счетчики корзин, сумма
+    и количество наблюдений.
+    '''
+    metric_type = 'histogram'
+
+    def __init__(self,
+                 registry: 'MetricsRegistry',
+                 name: str,
+                 documentation: str,
+                 label_names: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(registry, name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        if not self.registry.enabled:
+            return
+        key = self._get_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                sample = self._values[key] = {
+                    'buckets': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0,
+                }
+            sample['buckets'][index] += 1
+            sample['sum'] += value
+            sample['count'] += 1
+
+    @contextlib.contextmanager
+    def timer(self, **labels) -> Iterator[None]:
+        '''
+        Замер длительности блока кода. Может использоваться как
+        декоратор функции.
+        '''
+        if not self.registry.enabled:
+            yield
+            return
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def get_count(self, **labels) -> int:
+        with self._lock:
+            sample = self._values.get(self._get_key(labels))
+            return sample['count'] if sample is not None else 0
+
+    def _render_samples(self) -> List[str]:
+        with self._lock:
+            values = sorted(
+                (key, list(sample['buckets']), sample['sum'],
+                 sample['count'])
+                for key, sample in self._values.items())
+        lines = []
+        for key, buckets, total, count in values:
+            cumulative = 0
+            for bound, bucket_count in zip(
+                    self.buckets + (float('inf'),), buckets):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(
+                    (f'{self.name}_bucket'
+                     f'{self._format_labels(key, (("le", le),))} '
+                     f'{cumulative}'))
+            labels = self._format_labels(key)
+            lines.append(f'{self.name}_sum{labels} {total:.6f}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    Набор метрик процесса. Пока enabled равно False, метрики
+    не собираются и вызовы observe/inc сразу возвращаются.
+    '''
+
+    def __init__(self, enabled: bool = config.METRICS_ENABLED) -> None:
+        self.enabled = enabled
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, documentation: str,
+                label_names: Sequence[str] = ()) -> Counter:
+        metric = Counter(self, name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str,
+              label_names: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(self, name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str,
+                  label_names: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(self, name, documentation, label_names, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        '''Все метрики в текстовом формате Prometheus'''
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def clear(self) -> None:
+        for metric in self._metrics:
+            metric.clear()
+
+
+registry = MetricsRegistry()
+
+API_REQUEST_DURATION = registry.histogram(
+    'hotels_api_request_duration_seconds',
+    'Длительность запросов к API сервиса сайта с учетом повторов',
+    ('endpoint',))
+API_ERRORS = registry.counter(
+    'hotels_api_errors_total',
+    'Ошибки запросов к API сервиса сайта по коду ответа',
+    ('endpoint', 'status'))
+DB_WRITE_DURATION = registry.histogram(
+    'hotels_db_write_duration_seconds',
+    'Длительность записи в базу бота',
+    ('operation',))
+TELEGRAM_REQUEST_DURATION = registry.histogram(
+    'hotels_telegram_request_duration_seconds',
+    'Длительность запросов к Telegram Bot API без ожидания лимитов',
+    ('method',))
+TELEGRAM_ERRORS = registry.counter(
+    'hotels_telegram_errors_total',
+    'Ошибки запросов к Telegram Bot API по коду ответа',
+    ('method', 'status'))
+HANDLER_DURATION = registry.histogram(
+    'hotels_handler_duration_seconds',
+    'Длительность обработчиков сообщений бота',
+    ('handler',))
+CACHE_REQUESTS = registry.counter(
+    'hotels_cache_requests_total',
+    'Обращения к кэшам бота: попадания (hit) и промахи (miss)',
+    ('cache', 'result'))
+CACHE_EVICTIONS = registry.counter(
+    'hotels_cache_evictions_total',
+    'Записи, вытесненные из кэшей бота при переполнении',
+    ('cache',))
+CACHE_SIZE = registry.gauge(
+    'hotels_cache_size',
+    'Число записей в кэшах бота',
+    ('cache',))
+TELEGRAM_SEND_QUEUE_DEPTH = registry.gauge(
+    'hotels_telegram_send_queue_depth',
+    'Запросы к Telegram Bot API, ожидающие разрешения планировщика',
+    ('priority',))
+TELEGRAM_SEND_WAIT = registry.histogram(
+    'hotels_telegram_send_wait_seconds',
+    'Ожидание разрешения планировщика на запрос к Telegram Bot API',
+    ('priority',))
+
+
+def track_handler(handler: Callable) -> Callable:
+    '''Декоратор обработчика бота с замером длительности в метрики'''
+
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        with HANDLER_DURATION.timer(handler=handler.__name__):
+            return handler(*args, **kwargs)
+
+    return wrapper
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''Отдача метрик по GET /metrics'''
+
+    def do_GET(self) -> None:
+        if self.path != '/metrics':
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+def start_metrics_server(port: int,
+                         host: str = config.METRICS_HOST
+                         ) -> ThreadingHTTPServer:
+    '''Запуск HTTP сервера метрик в фоновом потоке'''
+    registry.enabled = True
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(
+        target=server.serve_forever, name='metrics-server', daemon=True
+    ).start()
+    logger.debug(f'Метрики доступны на http://{host}:{port}/metrics')
+    return server
@@ -0,0 +1,299 @@
+import functools
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.apihelper import ApiTelegramException
+from telebot.types import Message
+
+from config_data import config
+from utils.misc.metrics import (TELEGRAM_ERRORS, TELEGRAM_REQUEST_DURATION,
+                                TELEGRAM_SEND_QUEUE_DEPTH, TELEGRAM_SEND_WAIT)
+from utils.misc.tracing import tracer
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+
+class TokenBucket:
+    '''Ведро токенов: не больше rate событий в секунду, всплеск до capacity'''
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def get_delay(self, now: float, amount: float = 1) -> float:
+        '''
+        Время до появления amount свободных токенов в секундах.
+        Запрос больше capacity ждет полного ведра и уводит его в долг.
+        '''
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        delay = (0.0 if self.tokens >= needed
+                 else (needed - self.tokens) / self.rate)
+        return max(delay, self.blocked_until - now)
+
+    def take(self, amount: float = 1) -> None:
+        self.tokens -= amount
+
+    def block(self, seconds: float) -> None:
+        '''Запрет выдачи токенов на seconds секунд'''
+        self.blocked_until = max(self.blocked_until,
+                                 time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Ticket:
+    '''Ожидающий разрешения запрос к Telegram'''
+    __slots__ = ('priority', 'number', 'chat_id', 'cost', 'created_at',
+                 'event')
+
+    def __init__(self, priority: int, number: int, chat_id: int,
+                 cost: int = 1) -> None:
+        self.priority = priority
+        self.cost = cost
+        self.number = number
+        self.chat_id = chat_id
+        self.created_at = time.monotonic()
+        self.event = threading.Event()
+
+
+class SendScheduler:
+    '''
+    Планировщик исходящих запросов к Telegram Bot API.
+    Выдает разрешения на запросы с учетом общего ограничения бота
+    и ограничения каждого чата. Среди ожидающих первыми получают
+    разрешение интерактивные ответы (подсказки, календарь),
+    затем массовые сообщения с результатами поиска.
+    Сам запрос выполняется в потоке вызывающего обработчика.
+    Глубина очереди и время ожидания разрешения отдаются в метрики.
+    '''
+    PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive',
+                      PRIORITY_BULK: 'bulk'}
+
+    def __init__(self,
+                 global_rate: float = config.TELEGRAM_GLOBAL_RATE,
+                 global_burst: float = config.TELEGRAM_GLOBAL_BURST,
+                 chat_rate: float = config.TELEGRAM_CHAT_RATE,
+                 chat_burst: float = config.TELEGRAM_CHAT_BURST) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global_bucket = TokenBucket(global_rate, global_burst)
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self._waiting: List[_Ticket] = []
+        self._numbers = itertools.count()
+        self._condition = threading.Condition()
+        self._wait_stats = {
+            priority: {'count': 0, 'total': 0.0, 'max': 0.0}
+            for priority in (PRIORITY_INTERACTIVE, PRIORITY_BULK)
+        }
+        self._thread: Optional[threading.Thread] = None
+        for priority, name in self.PRIORITY_NAMES.items():
+            TELEGRAM_SEND_QUEUE_DEPTH.set_function(
+                functools.partial(self._get_queue_depth, priority),
+                priority=name)
+
+    def _get_queue_depth(self, priority: int) -> int:
+        with self._condition:
+            return sum(1 for ticket in self._waiting
+                       if ticket.priority == priority)
+
+    def _get_chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _remove_idle_buckets(self, now: float) -> None:
+        waiting_chats = {ticket.chat_id for ticket in self._waiting}
+        self._chat_buckets = {
+            chat_id: bucket
+            for chat_id, bucket in self._chat_buckets.items()
+            if chat_id in waiting_chats or not bucket.is_idle(now)
+        }
+
+    def _grant(self, now: float) -> Optional[float]:
+        '''
+        Выдача разрешений ожидающим запросам по приоритету.
+        Возвращает время до следующей возможной выдачи.
+        '''
+        next_delay = None
+        granted = []
+        for ticket in sorted(self._waiting,
+                             key=lambda item: (item.priority, item.number)):
+            global_delay = self._global_bucket.get_delay(now, ticket.cost)
+            if global_delay > 0:
+                next_delay = global_delay
+                break
+            chat_bucket = self._get_chat_bucket(ticket.chat_id)
+            chat_delay = chat_bucket.get_delay(now, ticket.cost)
+            if chat_delay > 0:
+                if next_delay is None or chat_delay < next_delay:
+                    next_delay = chat_delay
+                continue
+            self._global_bucket.take(ticket.cost)
+            chat_bucket.take(ticket.cost)
+            granted.append(ticket)
+        for ticket in granted:
+            self._waiting.remove(ticket)
+            waited = now - ticket.created_at
+            stats = self._wait_stats[ticket.priority]
+            stats['count'] += 1
+            stats['total'] += waited
+            stats['max'] = max(stats['max'], waited)
+            TELEGRAM_SEND_WAIT.observe(
+                waited, priority=self.PRIORITY_NAMES[ticket.priority])
+            ticket.event.set()
+        return next_delay
+
+    def _run(self) -> None:
+        with self._condition:
+            while True:
+                while not self._waiting:
+                    self._condition.wait()
+                now = time.monotonic()
+                next_delay = self._grant(now)
+                if len(self._chat_buckets) > 1000:
+                    self._remove_idle_buckets(now)
+                if self._waiting:
+                    self._condition.wait(next_delay)
+
+    def acquire(self, chat_id: int,
+                priority: int = PRIORITY_INTERACTIVE,
+                cost: int = 1) -> None:
+        '''
+        Ожидание разрешения на запрос в чат. cost - число сообщений
+        запроса, например фотографий альбома.
+        '''
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='send-scheduler', daemon=True)
+                self._thread.start()
+            ticket = _Ticket(priority, next(self._numbers), chat_id, cost)
+            self._waiting.append(ticket)
+            self._condition.notify()
+        ticket.event.wait()
+
+    def block_chat(self, chat_id: int, seconds: float) -> None:
+        '''Приостановка запросов в чат после ответа 429 от Telegram'''
+        with self._condition:
+            self._get_chat_bucket(chat_id).block(seconds)
+            self._condition.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        '''Глубина очереди и время ожидания разрешения по приоритетам'''
+        with self._condition:
+            result = {'queue_depth': len(self._waiting)}
+            for priority, name in self.PRIORITY_NAMES.items():
+                stats = self._wait_stats[priority]
+                result[f'{name}_queue_depth'] = sum(
+                    1 for ticket in self._waiting
+                    if ticket.priority == priority)
+                result[f'{name}_sent'] = stats['count']
+                result[f'{name}_wait_avg'] = (
+                    stats['total'] / stats['count'] if stats['count'] else 0)
+                result[f'{name}_wait_max'] = stats['max']
+            return result
+
+
+class TelegramSender:
+    '''
+    Отправка сообщений бота через планировщик SendScheduler.
+    Повторяет запрос, если Telegram ответил 429, выждав указанное время.
+    '''
+
+    def __init__(self,
+                 bot: TeleBot,
+                 scheduler: SendScheduler,
+                 max_retries: int = config.TELEGRAM_MAX_RETRIES) -> None:
+        self.bot = bot
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    def call(self, chat_id: int, priority: int,
+             func: Callable, *args, cost: int = 1, **kwargs) -> Any:
+        '''
+        Выполнение запроса к Telegram с учетом ограничений частоты.
+        cost - число сообщений, которые Telegram засчитывает запросу.
+        '''
+        with tracer.span(f'telegram {func.__name__}') as span:
+            for attempt in range(self.max_retries + 1):
+                acquire_started_at = time.perf_counter()
+                self.scheduler.acquire(chat_id, priority, cost)
+                if span is not None:
+                    span.attributes['wait'] = round(
+                        span.attributes.get('wait', 0)
+                        + time.perf_counter() - acquire_started_at, 6)
+                try:
+                    with TELEGRAM_REQUEST_DURATION.timer(
+                            method=func.__name__):
+                        return func(*args, **kwargs)
+                except ApiTelegramException as error:
+                    TELEGRAM_ERRORS.inc(
+                        method=func.__name__, status=error.error_code)
+                    if (error.error_code != 429
+                            or attempt == self.max_retries):
+                        raise
+                    retry_after = (error.result_json or {}).get(
+                        'parameters', {}).get('retry_after', 1)
+                    logger.warning(
+                        (f'Превышен лимит запросов Telegram для чата '
+                         f'{chat_id}, повтор через {retry_after}с'))
+                    self.scheduler.block_chat(chat_id, retry_after)
+
+    def send_message(self, chat_id: int, text: str,
+                     priority: int = PRIORITY_INTERACTIVE,
+                     **kwargs) -> Message:
+        return self.call(chat_id, priority,
+                         self.bot.send_message, chat_id, text, **kwargs)
+
+    def reply_to(self, message: Message, text: str,
+                 priority: int = PRIORITY_INTERACTIVE, **kwargs) -> Message:
+        return self.call(message.chat.id, priority,
+                         self.bot.reply_to, message, text, **kwargs)
+
+    def send_photo(self, chat_id: int, photo: Any,
+                   priority: int = PRIORITY_BULK, **kwargs) -> Message:
+        return self.call(chat_id, priority,
+                         self.bot.send_photo, chat_id, photo, **kwargs)
+
+    def send_media_group(self, chat_id: int, media: List,
+                         priority: int = PRIORITY_BULK,
+                         **kwargs) -> List[Message]:
+        return self.call(chat_id, priority,
+                         self.bot.send_media_group, chat_id, media,
+                         cost=len(media), **kwargs)
+
+    def edit_message_text(self, text: str, chat_id: int, message_id: int,
+                          priority: int = PRIORITY_INTERACTIVE,
+                          **kwargs) -> Any:
+        return self.call(chat_id, priority, self.bot.edit_message_text,
+                         text, chat_id, message_id, **kwargs)
+
+    def edit_message_reply_markup(self, chat_id: int, message_id: int,
+                                  priority: int = PRIORITY_INTERACTIVE,
+                                  **kwargs) -> Any:
+        return self.call(chat_id, priority,
+                         self.bot.edit_message_reply_markup,
+                         chat_id, message_id, **kwargs)
+
+    def delete_message(self, chat_id: int, message_id: int,
+                       priority: int = PRIORITY_INTERACTIVE) -> bool:
+        return self.call(chat_id, priority,
+                         self.bot.delete_message, chat_id, message_id)
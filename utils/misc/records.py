@@ -0,0 +1,21 @@
+'''
+Записи, которыми обмениваются API, обработчики и база данных.
+Модуль не зависит от слоев бота, поэтому его импортируют и api,
+и database.
+'''
+from typing import NamedTuple, Optional, Tuple
+
+
+class HotelResult(NamedTuple):
+    '''
+    Отель результата поиска: id, название, цена за ночь, расстояние
+    до центра, после получения сведений - адрес и ссылки на фотографии.
+    Одна запись используется от разбора ответа до отправки
+    пользователю и записи в историю.
+    '''
+    id: str
+    name: str
+    price: float
+    distance: float
+    address: Optional[str] = None
+    images: Tuple[str, ...] = ()
@@ -0,0 +1,233 @@
+'''
+Трассировка диалогов поиска отелей.
+Каждый шаг диалога (обработчик бота) - корневой span трассировки,
+id которой хранится в данных состояния диалога. Запросы к API,
+записи в базу и запросы к Telegram внутри шага - дочерние span.
+Завершенные span записываются в файл JSON Lines TRACE_FILE.
+
+Поиск самых медленных диалогов по файлу трассировки:
+    python -m utils.misc.tracing traces.jsonl --top 10
+'''
+import argparse
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+from config_data import config
+
+
+class Span:
+    '''Замер одного этапа трассировки'''
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name',
+                 'start', 'duration', 'attributes')
+
+    def __init__(self,
+                 trace_id: str,
+                 parent_id: Optional[str],
+                 name: str,
+                 attributes: Dict[str, Any]) -> None:
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.duration = 0.0
+        self.attributes = attributes
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start': round(self.start, 6),
+            'duration': round(self.duration, 6),
+            'attributes': self.attributes,
+        }
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = (
+    contextvars.ContextVar('current_span', default=None))
+
+
+def new_trace_id() -> str:
+    return os.urandom(16).hex()
+
+
+def get_current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def get_current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+class JsonlSpanExporter:
+    '''
+    Запись завершенных span в файл JSON Lines.
+    Span накапливаются в памяти и дописываются в файл фоновым потоком
+    раз в flush_interval секунд одной операцией записи.
+    '''
+
+    def __init__(self,
+                 path: str,
+                 flush_interval: float = config.TRACE_FLUSH_INTERVAL
+                 ) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.stop)
+
+    def _start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name='trace-exporter', daemon=True)
+            self._thread.start()
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+            self._start()
+
+    def flush(self) -> None:
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if not spans:
+            return
+        lines = ''.join(
+            json.dumps(span.to_dict(), ensure_ascii=False, default=str) + '\n'
+            for span in spans)
+        with open(self.path, 'a', encoding='utf-8') as trace_file:
+            trace_file.write(lines)
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as error:
+                logger.exception(f'Ошибка записи трассировки: {error}')
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+class Tracer:
+    '''
+    Создание span. Без экспортера (TRACE_FILE не задан) трассировка
+    выключена и span не создаются.
+    '''
+
+    def __init__(self, exporter: Optional[JsonlSpanExporter] = None) -> None:
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    @contextlib.contextmanager
+    def span(self,
+             name: str,
+             trace_id: Optional[str] = None,
+             **attributes) -> Iterator[Optional[Span]]:
+        '''
+        Замер блока кода. Внутри другого span создается дочерний span,
+        иначе - корневой span трассировки trace_id. Без текущего span
+        и trace_id ничего не замеряется. Может использоваться как
+        декоратор функции.
+        '''
+        parent = _current_span.get()
+        if self.exporter is None or (parent is None and trace_id is None):
+            yield None
+            return
+        if parent is not None:
+            span = Span(parent.trace_id, parent.span_id, name, attributes)
+        else:
+            span = Span(trace_id, None, name, attributes)
+        token = _current_span.set(span)
+        started_at = time.perf_counter()
+        try:
+            yield span
+        except Exception as error:
+            span.attributes['error'] = repr(error)
+            raise
+        finally:
+            span.duration = time.perf_counter() - started_at
+            _current_span.reset(token)
+            self.exporter.export(span)
+
+    def record_span(self,
+                    name: str,
+                    parent: Span,
+                    start: float,
+                    duration: float,
+                    **attributes) -> None:
+        '''
+        Запись уже завершенного дочернего span для parent, например
+        для работы, выполненной позже в другом потоке
+        '''
+        if self.exporter is None:
+            return
+        span = Span(parent.trace_id, parent.span_id, name, attributes)
+        span.start = start
+        span.duration = duration
+        self.exporter.export(span)
+
+
+tracer = Tracer(
+    JsonlSpanExporter(config.TRACE_FILE) if config.TRACE_FILE else None)
+
+
+def summarize_traces(path: str, top: int) -> None:
+    '''Вывод самых долгих диалогов и этапов, занявших больше всего времени'''
+    spans_by_trace = defaultdict(list)
+    with open(path, encoding='utf-8') as trace_file:
+        for line in trace_file:
+            span = json.loads(line)
+            spans_by_trace[span['trace_id']].append(span)
+    traces = []
+    for trace_id, spans in spans_by_trace.items():
+        steps = [span for span in spans if span['parent_id'] is None]
+        stages = defaultdict(float)
+        for span in spans:
+            if span['parent_id'] is not None:
+                stages[span['name']] += span['duration']
+        traces.append((
+            sum(step['duration'] for step in steps),
+            trace_id,
+            steps,
+            sorted(stages.items(), key=lambda item: -item[1])[:3],
+        ))
+    traces.sort(reverse=True)
+    for total, trace_id, steps, stages in traces[:top]:
+        slowest_step = max(steps, key=lambda step: step['duration'],
+                           default=None)
+        print(f'{trace_id}: {total:.3f}с, шагов {len(steps)}')
+        if slowest_step is not None:
+            print(f'    самый долгий шаг: {slowest_step["name"]} '
+                  f'{slowest_step["duration"]:.3f}с')
+        for name, duration in stages:
+            print(f'    {name}: {duration:.3f}с')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Самые медленные диалоги по файлу трассировки')
+    parser.add_argument('path')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    summarize_traces(args.path, args.top)
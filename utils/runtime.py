@@ -0,0 +1,113 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.types import Update
+
+from config_data import config
+
+
+def get_update_chat_id(update: Update) -> Optional[int]:
+    '''Получение id чата, к которому относится обновление'''
+    if update.message is not None:
+        return update.message.chat.id
+    if update.edited_message is not None:
+        return update.edited_message.chat.id
+    if (update.callback_query is not None
+            and update.callback_query.message is not None):
+        return update.callback_query.message.chat.id
+    return None
+
+
+class AsyncUpdateDispatcher:
+    '''
+    Асинхронная обработка обновлений бота.
+    Обработчики разных чатов выполняются параллельно в потоках,
+    обновления одного чата обрабатываются строго по порядку,
+    чтобы переходы состояния HotelQueryState не пересекались.
+    '''
+
+    def __init__(self,
+                 bot: TeleBot,
+                 concurrency: int = config.ASYNC_HANDLERS_CONCURRENCY
+                 ) -> None:
+        self.bot = bot
+        self.bot.threaded = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix='handlers')
+        self._chat_locks: Dict[int, Tuple[asyncio.Lock, int]] = {}
+        self._tasks = set()
+
+    def _acquire_chat_lock(self, chat_id: int) -> asyncio.Lock:
+        lock, users = self._chat_locks.get(chat_id, (asyncio.Lock(), 0))
+        self._chat_locks[chat_id] = (lock, users + 1)
+        return lock
+
+    def _release_chat_lock(self, chat_id: int) -> None:
+        lock, users = self._chat_locks[chat_id]
+        if users > 1:
+            self._chat_locks[chat_id] = (lock, users - 1)
+        else:
+            del self._chat_locks[chat_id]
+
+    async def process_update(self, update: Update) -> None:
+        '''Обработка одного обновления с соблюдением порядка в чате'''
+        chat_id = get_update_chat_id(update)
+        if chat_id is None:
+            chat_id = -update.update_id
+        lock = self._acquire_chat_lock(chat_id)
+        try:
+            async with lock:
+                await asyncio.get_running_loop().run_in_executor(
+                    self._executor, self.bot.process_new_updates, [update])
+        except Exception as error:
+            logger.exception(
+                f'Ошибка обработки обновления {update.update_id}: {error}')
+        finally:
+            self._release_chat_lock(chat_id)
+
+    def dispatch(self, update: Update) -> asyncio.Task:
+        '''Запуск обработки обновления в фоне'''
+        task = asyncio.create_task(self.process_update(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def join(self) -> None:
+        '''Ожидание завершения обработки всех запущенных обновлений'''
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks))
+
+    async def polling(self,
+                      skip_pending: bool = False,
+                      timeout: int = 20) -> None:
+        '''Получение обновлений long polling и их параллельная обработка'''
+        offset = None
+        if skip_pending:
+            updates = await asyncio.to_thread(
+                self.bot.get_updates, offset=-1, timeout=1)
+            if updates:
+                offset = updates[-1].update_id + 1
+        while True:
+            try:
+                updates = await asyncio.to_thread(
+                    self.bot.get_updates,
+                    offset=offset,
+                    timeout=timeout,
+                    long_polling_timeout=timeout
+                )
+            except Exception as error:
+                logger.exception(f'Ошибка получения обновлений: {error}')
+                await asyncio.sleep(3)
+                continue
+            for update in updates:
+                offset = update.update_id + 1
+                self.dispatch(update)
+
+
+def run_async_polling(bot: TeleBot, skip_pending: bool = False) -> None:
+    '''Запуск бота в асинхронном режиме'''
+    dispatcher = AsyncUpdateDispatcher(bot)
+    asyncio.run(dispatcher.polling(skip_pending=skip_pending))
@@ -0,0 +1,201 @@
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+from typing import Callable, List, Optional
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.types import Update
+
+from config_data import config
+from utils.misc.metrics import start_metrics_server
+from utils.runtime import get_update_chat_id
+from utils.webhook import UpdateWorkerPool, run_webhook
+
+
+def get_shard_index(update: Update, shards_count: int) -> int:
+    '''
+    Номер процесса-обработчика для обновления. Обновления одного чата
+    всегда попадают в один процесс, поэтому состояние диалога
+    пользователя не переходит между процессами.
+    '''
+    chat_id = get_update_chat_id(update)
+    if chat_id is None:
+        return update.update_id % shards_count
+    return chat_id % shards_count
+
+
+def run_shard_worker(shard_index: int,
+                     updates_queue: multiprocessing.Queue,
+                     setup: Callable[[], None],
+                     shards_count: int) -> None:
+    '''
+    Процесс-обработчик: получает обновления своей части чатов от
+    супервизора и обрабатывает их пулом потоков UpdateWorkerPool
+    '''
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    from loader import bot
+
+    setup()
+    if config.METRICS_PORT:
+        start_metrics_server(config.METRICS_PORT + 1 + shard_index)
+    pool = UpdateWorkerPool(bot, shards_count=shards_count)
+    pool.start()
+    logger.debug(f'Процесс-обработчик {shard_index} запущен')
+    while True:
+        update = updates_queue.get()
+        if update is None:
+            break
+        pool.put(update)
+    pool.stop()
+    logger.debug(f'Процесс-обработчик {shard_index} остановлен')
+
+
+class ShardSupervisor:
+    '''
+    Супервизор процессов-обработчиков обновлений.
+    Обновления распределяются по shards_count процессам по id чата,
+    у каждого процесса своя ограниченная очередь. Процессы запускаются
+    методом spawn, поэтому не наследуют соединения с базой и потоки
+    супервизора. Завершившиеся процессы перезапускаются.
+    '''
+
+    def __init__(self,
+                 setup: Callable[[], None],
+                 shards_count: int = config.BOT_SHARDS,
+                 queue_size: int = config.SHARD_QUEUE_SIZE,
+                 check_interval: float = config.SHARD_CHECK_INTERVAL
+                 ) -> None:
+        self.setup = setup
+        self.shards_count = shards_count
+        self.queue_size = queue_size
+        self.check_interval = check_interval
+        self._context = multiprocessing.get_context('spawn')
+        self._queues: List[multiprocessing.Queue] = [
+            self._context.Queue(maxsize=queue_size)
+            for _ in range(shards_count)
+        ]
+        self._processes: List[Optional[multiprocessing.Process]] = (
+            [None] * shards_count)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def _start_worker(self, shard_index: int) -> None:
+        process = self._context.Process(
+            target=run_shard_worker,
+            args=(shard_index, self._queues[shard_index], self.setup,
+                  self.shards_count),
+            name=f'shard-worker-{shard_index}',
+            daemon=True
+        )
+        process.start()
+        self._processes[shard_index] = process
+
+    def _replace_queue(self, shard_index: int) -> None:
+        '''
+        Замена очереди завершившегося процесса: он мог остановиться,
+        удерживая блокировку чтения очереди. Необработанные обновления
+        из старой очереди теряются.
+        '''
+        old_queue = self._queues[shard_index]
+        self._queues[shard_index] = self._context.Queue(
+            maxsize=self.queue_size)
+        old_queue.cancel_join_thread()
+        old_queue.close()
+
+    def _check_workers(self) -> None:
+        with self._lock:
+            for shard_index, process in enumerate(self._processes):
+                if self._stop_event.is_set():
+                    return
+                if process is not None and not process.is_alive():
+                    logger.error(
+                        (f'Процесс-обработчик {shard_index} завершился '
+                         f'с кодом {process.exitcode}, перезапуск'))
+                    self._replace_queue(shard_index)
+                    self._start_worker(shard_index)
+
+    def _monitor_workers(self) -> None:
+        while not self._stop_event.wait(self.check_interval):
+            self._check_workers()
+
+    def start(self) -> None:
+        with self._lock:
+            for shard_index in range(self.shards_count):
+                self._start_worker(shard_index)
+        self._monitor = threading.Thread(
+            target=self._monitor_workers, name='shard-monitor', daemon=True)
+        self._monitor.start()
+
+    def put(self, update: Update, timeout: Optional[float] = None) -> bool:
+        '''
+        Передача обновления процессу его чата. Если очередь процесса
+        заполнена дольше timeout секунд, возвращается False.
+        '''
+        shard_index = get_shard_index(update, self.shards_count)
+        try:
+            self._queues[shard_index].put(update, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self) -> None:
+        '''Обработка переданных обновлений и остановка процессов'''
+        self._stop_event.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        for updates_queue in self._queues:
+            updates_queue.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join()
+
+
+def poll_updates(bot: TeleBot,
+                 supervisor: ShardSupervisor,
+                 skip_pending: bool = False,
+                 timeout: int = 20) -> None:
+    '''Получение обновлений long polling и передача их обработчикам'''
+    offset = None
+    if skip_pending:
+        updates = bot.get_updates(offset=-1, timeout=1)
+        if updates:
+            offset = updates[-1].update_id + 1
+    while True:
+        try:
+            updates = bot.get_updates(
+                offset=offset, timeout=timeout, long_polling_timeout=timeout)
+        except Exception as error:
+            logger.exception(f'Ошибка получения обновлений: {error}')
+            time.sleep(3)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            supervisor.put(update)
+
+
+def run_sharded(bot: TeleBot,
+                setup: Callable[[], None],
+                skip_pending: bool = False) -> None:
+    '''
+    Запуск бота несколькими процессами: текущий процесс получает
+    обновления (webhook или long polling) и распределяет их по
+    BOT_SHARDS процессам-обработчикам, setup настраивает бота
+    в каждом процессе-обработчике
+    '''
+    supervisor = ShardSupervisor(setup)
+    if config.BOT_RUNTIME == 'webhook':
+        run_webhook(bot, skip_pending=skip_pending, pool=supervisor)
+        return
+    supervisor.start()
+    logger.debug(
+        f'Запущено процессов-обработчиков: {supervisor.shards_count}')
+    try:
+        poll_updates(bot, supervisor, skip_pending=skip_pending)
+    except KeyboardInterrupt:
+        logger.debug('Остановка получения обновлений')
+    finally:
+        supervisor.stop()
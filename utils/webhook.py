@@ -0,0 +1,170 @@
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from loguru import logger
+from telebot import TeleBot
+from telebot.types import Update
+
+from config_data import config
+from utils.runtime import get_update_chat_id
+
+
+class UpdateWorkerPool:
+    '''
+    Пул потоков обработки обновлений с ограниченными очередями.
+    У каждого потока своя очередь, обновление попадает в очередь
+    потока по id чата, поэтому обновления одного чата обрабатываются
+    одним потоком строго по порядку и никогда одновременно.
+    В процессе-обработчике shards_count - число процессов: чаты
+    процесса уже отобраны по chat_id % shards_count, и для равномерной
+    загрузки потоков номер потока берется от chat_id // shards_count.
+    '''
+
+    def __init__(self,
+                 bot: TeleBot,
+                 workers_count: int = config.WEBHOOK_WORKERS,
+                 queue_size: int = config.WEBHOOK_QUEUE_SIZE,
+                 shards_count: int = 1) -> None:
+        self.bot = bot
+        self.shards_count = shards_count
+        self.bot.threaded = False
+        self._queues: List[queue.Queue] = [
+            queue.Queue(maxsize=max(1, queue_size // workers_count))
+            for _ in range(workers_count)
+        ]
+        self._workers: List[threading.Thread] = [
+            threading.Thread(
+                target=self._work,
+                args=(worker_queue,),
+                name=f'webhook-worker-{number}',
+                daemon=True)
+            for number, worker_queue in enumerate(self._queues)
+        ]
+
+    def start(self) -> None:
+        for worker in self._workers:
+            worker.start()
+
+    def _get_queue(self, update: Update) -> queue.Queue:
+        '''Очередь потока для чата обновления'''
+        chat_id = get_update_chat_id(update)
+        if chat_id is None:
+            chat_id = update.update_id
+        return self._queues[
+            chat_id // self.shards_count % len(self._queues)]
+
+    def put(self, update: Update, timeout: Optional[float] = None) -> bool:
+        '''
+        Постановка обновления в очередь. Если очередь заполнена дольше
+        timeout секунд, обновление не принимается и возвращается False.
+        '''
+        try:
+            self._get_queue(update).put(update, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def qsize(self) -> int:
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def _process(self, update: Update) -> None:
+        try:
+            self.bot.process_new_updates([update])
+        except Exception as error:
+            logger.exception(
+                f'Ошибка обработки обновления {update.update_id}: {error}')
+
+    def _work(self, worker_queue: queue.Queue) -> None:
+        while True:
+            update = worker_queue.get()
+            try:
+                if update is None:
+                    return
+                self._process(update)
+            finally:
+                worker_queue.task_done()
+
+    def stop(self) -> None:
+        '''Обработка оставшихся в очереди обновлений и остановка потоков'''
+        for worker_queue in self._queues:
+            worker_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+
+
+def make_webhook_handler(pool: UpdateWorkerPool,
+                         path: str,
+                         secret_token: Optional[str] = None) -> type:
+    '''Класс обработчика HTTP запросов Telegram с обновлениями'''
+
+    class WebhookHandler(BaseHTTPRequestHandler):
+
+        def do_POST(self) -> None:
+            if self.path != path:
+                self.send_response(404)
+                self.end_headers()
+                return
+            if (secret_token and self.headers.get(
+                    'X-Telegram-Bot-Api-Secret-Token') != secret_token):
+                self.send_response(403)
+                self.end_headers()
+                return
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                update = Update.de_json(
+                    self.rfile.read(length).decode('utf-8'))
+            except Exception as error:
+                logger.error(f'Некорректное обновление от Telegram: {error}')
+                self.send_response(400)
+                self.end_headers()
+                return
+            if pool.put(update, timeout=config.WEBHOOK_QUEUE_TIMEOUT):
+                self.send_response(200)
+            else:
+                logger.warning(
+                    (f'Очередь обновлений заполнена, обновление '
+                     f'{update.update_id} будет повторно отправлено Telegram'))
+                self.send_response(503)
+            self.end_headers()
+
+        def log_message(self, format: str, *args) -> None:
+            logger.debug(f'Webhook {self.address_string()}: {format % args}')
+
+    return WebhookHandler
+
+
+def run_webhook(bot: TeleBot,
+                skip_pending: bool = False,
+                pool: Optional[UpdateWorkerPool] = None) -> None:
+    '''
+    Запуск бота в режиме webhook с пулом обработчиков обновлений.
+    Вместо пула потоков можно передать ShardSupervisor с теми же
+    методами start, put и stop.
+    '''
+    path = f'/{config.BOT_TOKEN.split(":")[0]}/'
+    if pool is None:
+        pool = UpdateWorkerPool(bot)
+    server = ThreadingHTTPServer(
+        (config.WEBHOOK_HOST, config.WEBHOOK_PORT),
+        make_webhook_handler(pool, path, config.WEBHOOK_SECRET)
+    )
+    bot.remove_webhook()
+    bot.set_webhook(
+        url=f'{config.WEBHOOK_URL.rstrip("/")}{path}',
+        max_connections=config.WEBHOOK_WORKERS,
+        drop_pending_updates=skip_pending,
+        secret_token=config.WEBHOOK_SECRET
+    )
+    pool.start()
+    logger.debug(
+        (f'Webhook сервер запущен на {config.WEBHOOK_HOST}:'
+         f'{config.WEBHOOK_PORT}, обработчиков: {config.WEBHOOK_WORKERS}'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.debug('Остановка webhook сервера')
+    finally:
+        server.server_close()
+        pool.stop()